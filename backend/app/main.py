@@ -1,8 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.routers import auth, receipts, expenses, game, budgets, ai
+from app.routers import auth, receipts, expenses, game, budgets, ai, health
 from app.database import check_db_connection
+from app.services.ocr_executor import get_executor, shutdown_executor, start_warm_up, OCR_WARMUP
+from app.services.ocr_cache import ensure_cache_indexes
+from app.services.idempotency import ensure_idempotency_indexes
+from app.services.ocr_profiles import active_archs
+from app.services.weight_store import OCR_WEIGHTS_DIR, verify_weight_store
+from app.services.job_queue import JOB_RUN_IN_API, ensure_job_indexes, start_workers, stop_workers
+from app.services.receipt_service import discard_upload_job, ensure_receipt_indexes, handle_upload_job
 import logging
 
 # Setup Logging
@@ -18,6 +25,24 @@ async def startup_event():
     load_dotenv() # Explicitly load .env
     logger.info(f"Starting up with Python: {sys.executable}")
     await check_db_connection()
+    await ensure_cache_indexes()
+    await ensure_idempotency_indexes()
+    await ensure_job_indexes()
+    await ensure_receipt_indexes()
+    if OCR_WEIGHTS_DIR:
+        # Refuse to start with a missing or corrupt offline weight store
+        verify_weight_store(active_archs())
+    get_executor()
+    if OCR_WARMUP:
+        start_warm_up()
+    if JOB_RUN_IN_API:
+        # Drains async uploads; dedicated worker.py processes can share the load
+        start_workers(handle_upload_job, on_cancel=discard_upload_job)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_workers()
+    shutdown_executor()
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +61,7 @@ app.include_router(expenses.router, prefix="/api/expenses", tags=["expenses"])
 app.include_router(game.router, prefix="/api/game", tags=["game"])
 app.include_router(budgets.router, prefix="/api/budgets", tags=["budgets"])
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
+app.include_router(health.router, prefix="/api/health", tags=["health"])
 # Import users router inside main to avoid circular imports if any, or just import at top
 from app.routers import users
 app.include_router(users.router, prefix="/api/users", tags=["users"])
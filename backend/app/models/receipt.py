@@ -18,6 +18,14 @@ class ReceiptSchema(BaseModel):
     items: List[ReceiptItem] = []
     raw_text: Optional[str] = None
     ocr_confidence: Optional[float] = None
+    content_hash: Optional[str] = None
+    # Position of this receipt when one photo held several
+    region: Optional[int] = None
+    # Upload job that created this receipt (async uploads)
+    job_id: Optional[str] = None
+    ocr_tier: Optional[str] = None
+    ocr_passes: Optional[int] = None
+    preprocessing: Optional[dict] = None
 
 class ExpenseSchema(BaseModel):
     user_id: Optional[str] = None
@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.services.job_queue import queue_stats
+from app.services.ocr_admission import admission_stats
+from app.services.ocr_executor import ocr_status
+
+router = APIRouter()
+
+@router.get("/ocr")
+async def ocr_readiness():
+    """
+    Readiness probe for load balancers. In eager mode (OCR_WARMUP) this returns
+    503 until every worker has loaded the model and run a dummy inference.
+    In lazy mode the model loads on first use, so the probe never blocks traffic.
+    """
+    status = dict(ocr_status)
+    if status["receipts_processed"]:
+        # Average model passes per receipt: 1.0 means the first tier always sufficed
+        status["avg_passes_per_receipt"] = round(status["ocr_passes"] / status["receipts_processed"], 3)
+    # OCR slots in use, uploads waiting per lane and how long they waited
+    status["admission"] = admission_stats()
+    status_code = 503 if status["mode"] == "eager" and not status["ready"] else 200
+    return JSONResponse(status_code=status_code, content=status)
+
+
+@router.get("/queue")
+async def queue_health():
+    """
+    Load on the OCR pipeline for monitoring: in-process admission queue
+    (depth and wait times per lane) and the durable upload job queue.
+    """
+    try:
+        jobs = await queue_stats()
+    except Exception as e:
+        jobs = {"error": str(e)}
+    return {"admission": admission_stats(), "jobs": jobs}
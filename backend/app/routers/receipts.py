@@ -1,13 +1,23 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from typing import List, Optional
 from app.utils.security import verify_password, ALGORITHM, SECRET_KEY
 from app.database import get_database
 from app.models.receipt import ReceiptSchema
-from app.services.ocr_service import extract_text
-from app.services.game_service import update_monthly_streak
+from app.services.idempotency import (
+    MAX_KEY_LENGTH, IdempotencyInProgress, IdempotencyKeyReused, claim_key, release_key, request_fingerprint, store_response
+)
+from app.services.job_queue import FINISHED_STATUSES
+from app.services.ocr_admission import LANES, AdmissionQueueFull
+from app.services.ocr_cache import content_hash, get_cached_results
+from app.services.receipt_service import (
+    cancel_upload_job, create_upload_job, discard_upload_file, get_upload_job, process_upload, upload_response
+)
 
 from datetime import datetime
-import shutil
+import asyncio
+import json
 import os
 import uuid
 from app.utils.security import get_current_user
@@ -18,136 +28,257 @@ UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
+# How often the job event stream checks for progress
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "0.5"))
+
+# How often a synchronous upload checks whether its client is still connected
+UPLOAD_DISCONNECT_POLL_SECONDS = float(os.getenv("UPLOAD_DISCONNECT_POLL_SECONDS", "0.5"))
+
+class ClientDisconnected(Exception):
+    pass
+
+async def _process_unless_disconnected(request: Request, **upload) -> dict:
+    """
+    Runs process_upload, abandoning it (queued or mid-OCR) if the client goes
+    away before its receipts are being saved.
+    """
+    state = {"cancellable": True}
+
+    async def progress(stage: str, cancellable: bool = True):
+        state["cancellable"] = cancellable
+
+    task = asyncio.create_task(process_upload(progress=progress, **upload))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=UPLOAD_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if state["cancellable"] and await request.is_disconnected():
+                task.cancel()
+                try:
+                    # Finishes anyway if saving had just started
+                    return await task
+                except asyncio.CancelledError:
+                    raise ClientDisconnected()
+    finally:
+        task.cancel()
+
 @router.post("/upload")
 async def upload_receipt(
+    request: Request,
     file: UploadFile = File(...), 
     manual_date: Optional[str] = Query(None),
     manual_category: Optional[str] = Query(None),
+    skip_duplicates: bool = Query(False),
+    debug: bool = Query(False),
+    async_mode: bool = Query(False, alias="async"),
+    priority: str = Query("interactive"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: dict = Depends(get_current_user)
 ):
+    # Backfills and batch imports should pass priority=bulk so they never delay users
+    if priority not in LANES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(LANES)}")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
 
-    
+    # Keep the upload in memory for OCR; the disk copy is only for serving the image
+    file_bytes = await file.read()
+    file_hash = content_hash(file_bytes)
+    upload = dict(
+        request=request, file_bytes=file_bytes, file_hash=file_hash, original_name=file.filename,
+        manual_date=manual_date, manual_category=manual_category, skip_duplicates=skip_duplicates,
+        debug=debug, async_mode=async_mode, priority=priority, current_user=current_user
+    )
+    if idempotency_key is None:
+        return await _upload(**upload)
+
+    # A retried request (same key, same upload) gets the first response back
+    # instead of running OCR and saving the receipts again
+    user_id = current_user["user_id"]
+    fingerprint = request_fingerprint(
+        file_hash, manual_date, manual_category, skip_duplicates, async_mode, priority
+    )
+    try:
+        stored = await claim_key(user_id, idempotency_key, fingerprint)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": str(e), "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if stored is not None:
+        return JSONResponse(
+            status_code=stored["status_code"], content=stored["content"], headers={"Idempotent-Replayed": "true"}
+        )
+
+    try:
+        response = await _upload(**upload)
+    except BaseException:
+        await release_key(user_id, idempotency_key)
+        raise
+    if isinstance(response, Response):
+        status_code = response.status_code
+        content = json.loads(response.body) if 200 <= status_code < 300 else None
+    else:
+        status_code, content = 200, jsonable_encoder(response)
+    if content is None:
+        # Overload, disconnect: nothing was done, so a retry should run again
+        await release_key(user_id, idempotency_key)
+    else:
+        await store_response(user_id, idempotency_key, status_code, content)
+    return response
+
+async def _upload(
+    request: Request,
+    file_bytes: bytes,
+    file_hash: str,
+    original_name: str,
+    manual_date: Optional[str],
+    manual_category: Optional[str],
+    skip_duplicates: bool,
+    debug: bool,
+    async_mode: bool,
+    priority: str,
+    current_user: dict
+):
     try:
+        db = get_database()
+
+        # Same photo already uploaded by this user (retry, double tap)
+        if skip_duplicates:
+            existing = await db.receipts.find({
+                "user_id": current_user["user_id"],
+                "content_hash": file_hash
+            }).sort("region", 1).to_list(length=None)
+            if existing:
+                cached = await get_cached_results(file_hash) or []
+                receipts = []
+                for index, doc in enumerate(existing):
+                    parsed_data = cached[index] if index < len(cached) else {
+                        "merchant_name": doc.get("merchant_name"),
+                        "total_amount": doc.get("total_amount"),
+                        "raw_text": doc.get("raw_text", "")
+                    }
+                    parsed_data["date_extracted"] = doc.get("date_extracted")
+                    receipts.append({"receipt_id": str(doc["_id"]), "parsed_data": parsed_data})
+                return upload_response("Duplicate receipt, already processed", receipts, duplicate=True)
+
         # Save file
-        file_ext = file.filename.split(".")[-1]
+        file_ext = original_name.split(".")[-1]
         filename = f"{uuid.uuid4()}.{file_ext}"
         filepath = os.path.join(UPLOAD_DIR, filename)
         
         with open(filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Read file for OCR
-        with open(filepath, "rb") as f:
-            file_bytes = f.read()
-        
-        from app.services.ocr_service import log_to_file
-        log_to_file(f"Starting OCR for file: {filename}")
-            
-        # Run OCR
-        # extract_text now returns a structured dict result directly (ReceiptAnalyzer integration)
-        parsed_data = extract_text(file_bytes)
-        log_to_file(f"OCR completed. Merchant: {parsed_data.get('merchant_name')}")
-        
-        # Categorize Merchant
-        merchant = parsed_data.get("merchant_name", "Unknown") or "Unknown"
-        detected_category = "Shopping"
-        
-        # Simple Keyword Categorization
-        m_lower = merchant.lower()
-        if any(k in m_lower for k in ['food', 'kitchen', 'restaurant', 'cafe', 'bhat', 'pizza']): detected_category = "Food"
-        elif any(k in m_lower for k in ['mart', 'store', 'market', 'grocery', 'kirana']): detected_category = "Groceries"
-        elif any(k in m_lower for k in ['fuel', 'petrol', 'taxi', 'ride']): detected_category = "Transport"
-        
-        # Enrich items with categories (Prioritize Manual Category if set)
-        enriched_items = []
-        for item in parsed_data.get("items", []):
-            category = manual_category if manual_category else detected_category
-            enriched_items.append({
-                "description": item["item_name"], # Note: ReceiptAnalyzer uses 'item_name'
-                "amount": item["price"],          # Note: ReceiptAnalyzer uses 'price'
-                "quantity": 1.0,
-                "category": category
-            })
-        
-        # Determine date - Prioritize OCR extraction, fallback to manual, then upload date
-        final_date = parsed_data.get("date_extracted")
-        
-        # If manual date provided and OCR failed, use manual
-        if not final_date and manual_date:
-            try:
-                final_date = datetime.fromisoformat(manual_date.replace('Z', '+00:00'))
-            except:
-                pass
-        
-        # Final fallback: use upload date
-        if not final_date:
-            final_date = datetime.utcnow()
-
-        # Create Receipt Object
-        receipt_data = {
-            "user_id": current_user["user_id"],
-            "image_url": filepath, # In prod, return a static URL
-            "uploaded_at": datetime.utcnow(),
-            "merchant_name": parsed_data.get("merchant_name", "Unknown"),
-            "total_amount": parsed_data.get("total_amount") or 0.0,
-            "date_extracted": final_date,
-            "raw_text": parsed_data.get("raw_text", ""),
-            "items": enriched_items
-        }
-        
-        db = get_database()
-        new_receipt = await db.receipts.insert_one(receipt_data)
-        receipt_id = str(new_receipt.inserted_id)
- 
-        # 2. Insert individual items as Expenses for Analytics
-        expense_docs = []
-        for item in enriched_items:
-            expense_docs.append({
-                "user_id": current_user["user_id"],
-                "description": item["description"],
-                "amount": item["amount"],
-                "category": item["category"],
-                "date": final_date,
-                "receipt_id": receipt_id,
-                "created_at": datetime.utcnow()
-            })
-            
-        if expense_docs:
-            await db.expenses.insert_many(expense_docs)
-        elif receipt_data["total_amount"] > 0:
-            # Fallback: If no items parsed but we have a total, create a single expense
-            merchant_name = parsed_data.get("merchant_name", "Receipt Total")
-            
-            await db.expenses.insert_one({
-                "user_id": current_user["user_id"],
-                "description": merchant_name,
-                "amount": receipt_data["total_amount"],
-                "category": manual_category or detected_category,
-                "date": final_date,
-                "receipt_id": receipt_id,
-                "created_at": datetime.utcnow()
+            buffer.write(file_bytes)
+
+        if async_mode:
+            # Answer right away; the client polls the job (or streams its events) for the result
+            job_id = await create_upload_job(
+                current_user["user_id"], file_hash, filepath,
+                manual_date=manual_date, manual_category=manual_category, lane=priority
+            )
+            return JSONResponse(status_code=202, content={
+                "message": "Receipt uploaded, processing",
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/api/receipts/jobs/{job_id}"
             })
-        
-        # Update parsed_data with the final decided values so frontend sees them
-        parsed_data["date_extracted"] = final_date
-        parsed_data["merchant_name"] = parsed_data.get("merchant_name") # Keep as is
-        
-        # Update Streak (Monthly)
-        await update_monthly_streak(current_user["user_id"])
-        
-        
-        return {
-            "message": "Receipt uploaded and processed", 
-            "receipt_id": str(new_receipt.inserted_id),
-            "parsed_data": parsed_data
-        }
-        
+
+        response = await _process_unless_disconnected(
+            request,
+            user_id=current_user["user_id"], file_bytes=file_bytes, file_hash=file_hash, filepath=filepath,
+            manual_date=manual_date, manual_category=manual_category, lane=priority
+        )
+        if not debug:
+            # Per-stage wall times in ms (None when the result came from the OCR cache)
+            response.pop("timings", None)
+        return response
+
+    except ClientDisconnected:
+        # Nobody is waiting for the result; nothing was saved
+        print(f"UPLOAD ABANDONED: {filepath}")
+        discard_upload_file(filepath)
+        return Response(status_code=499)
+    except AdmissionQueueFull as e:
+        # Overloaded: the client should come back later rather than queue forever
+        discard_upload_file(filepath)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(e), "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         print(f"UPLOAD FAILED: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _job_view(job: dict, debug: bool) -> dict:
+    if not debug and job.get("result"):
+        job["result"] = {k: v for k, v in job["result"].items() if k != "timings"}
+    return job
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job_status(
+    job_id: str,
+    debug: bool = Query(False),
+    current_user: dict = Depends(get_current_user)
+):
+    job = await get_upload_job(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job, debug)
+
+@router.delete("/jobs/{job_id}")
+async def cancel_upload_job_route(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Cancels a pending upload. Queued jobs are cancelled at once (202 is
+    returned while a running one stops at its next OCR stage boundary);
+    finished jobs are left as they are.
+    """
+    job = await cancel_upload_job(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    status_code = 202 if job["status"] == "processing" else 200
+    return JSONResponse(status_code=status_code, content=jsonable_encoder(_job_view(job, False)))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_upload_job(
+    job_id: str,
+    debug: bool = Query(False),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Server-sent events: one "status" event whenever the job's stage changes,
+    ending once it is done, failed or dead-lettered.
+    """
+    job = await get_upload_job(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last_stage = None
+        current = job
+        while True:
+            if current is None:
+                return
+            if current["stage"] != last_stage:
+                last_stage = current["stage"]
+                payload = json.dumps(jsonable_encoder(_job_view(current, debug)))
+                yield f"event: status\ndata: {payload}\n\n"
+            if current["status"] in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            current = await get_upload_job(job_id, current_user["user_id"])
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @router.get("/")
 async def get_receipts(
     current_user: dict = Depends(get_current_user),
@@ -196,10 +327,18 @@ async def delete_receipt(
     if not receipt:
         raise HTTPException(status_code=404, detail="Receipt not found")
         
-    # 1. Delete associated Image File
+    # 1. Delete associated Image File, unless other receipts cropped from the same photo still use it
     try:
-        if receipt.get("image_url") and os.path.exists(receipt["image_url"]):
-            os.remove(receipt["image_url"])
+        if receipt.get("image_url"):
+            # Crops of one photo share its owner and content hash, which are indexed
+            shared = await db.receipts.count_documents({
+                "user_id": current_user["user_id"],
+                "content_hash": receipt.get("content_hash"),
+                "image_url": receipt["image_url"],
+                "_id": {"$ne": r_oid}
+            })
+            if not shared and os.path.exists(receipt["image_url"]):
+                os.remove(receipt["image_url"])
     except Exception as e:
         print(f"Error deleting file: {e}")
         
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# How long a key (and the response stored under it) is remembered
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+# A repeated request waits this long for the original one to finish before
+# giving up with 409; the original is presumed dead after IDEMPOTENCY_LOCK_SECONDS
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "600"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.25"))
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    The key was already used by this user for a different request.
+    """
+
+
+class IdempotencyInProgress(Exception):
+    """
+    The original request is still running; retry_after is the suggested delay in seconds.
+    """
+    def __init__(self, retry_after: int):
+        super().__init__("A request with this Idempotency-Key is still being processed")
+        self.retry_after = retry_after
+
+
+def request_fingerprint(*parts) -> str:
+    # Parts of the request that must match for a key to be replayed
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+async def ensure_idempotency_indexes():
+    db = get_database()
+    try:
+        await db.idempotency_keys.create_index([("user_id", 1), ("key", 1)], unique=True)
+        # Mongo drops each record once its expires_at has passed
+        await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        logger.error(f"Failed to create idempotency key indexes: {e}")
+
+
+async def claim_key(user_id: str, key: str, fingerprint: str) -> Optional[Dict]:
+    """
+    Reserves key for this request. Returns None when the caller should process
+    the request (then store_response or release_key), or the stored response
+    ({"status_code", "content"}) when an earlier request with the same key
+    completed. Waits while that request is still in flight.
+    """
+    db = get_database()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.utcnow()
+        try:
+            await db.idempotency_keys.insert_one({
+                "user_id": user_id,
+                "key": key,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "response": None,
+                "locked_at": now,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key})
+        if record is None:
+            # Released (original failed) or expired meanwhile: take it
+            continue
+        if record["fingerprint"] != fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+        if record["status"] == "done":
+            return record["response"]
+        if record["locked_at"] < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS):
+            # The process handling it died; let this request run instead
+            await db.idempotency_keys.delete_one({"_id": record["_id"], "locked_at": record["locked_at"]})
+            continue
+        if loop.time() >= deadline:
+            raise IdempotencyInProgress(retry_after=5)
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+async def store_response(user_id: str, key: str, status_code: int, content: Dict):
+    db = get_database()
+    try:
+        await db.idempotency_keys.update_one(
+            {"user_id": user_id, "key": key},
+            {"$set": {"status": "done", "response": {"status_code": status_code, "content": content}}},
+        )
+    except Exception as e:
+        # The upload itself succeeded; a retry would just run it again
+        logger.error(f"Failed to store idempotent response: {e}")
+        await release_key(user_id, key)
+
+
+async def release_key(user_id: str, key: str):
+    """
+    Forgets a pending key whose request failed, so a retry runs it again.
+    """
+    db = get_database()
+    try:
+        await db.idempotency_keys.delete_one({"user_id": user_id, "key": key, "status": "pending"})
+    except Exception as e:
+        logger.error(f"Failed to release idempotency key: {e}")
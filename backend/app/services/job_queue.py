@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# A claimed job belongs to its worker until the lease runs out; the worker
+# renews it every JOB_HEARTBEAT_SECONDS. Jobs whose lease expired (worker
+# crashed or was killed) are claimed again by the next free worker.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+
+# Running jobs check this often whether their cancellation was requested
+JOB_CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", "1"))
+
+# Attempts before a job is dead-lettered; the n-th retry waits
+# JOB_RETRY_BACKOFF_SECONDS * 2^(n-1)
+JOB_MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3")))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "5"))
+
+# Idle workers look for new jobs this often (jobs enqueued by the same
+# process wake them immediately)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Jobs processed at once by one worker process
+JOB_WORKER_CONCURRENCY = max(1, int(os.getenv("JOB_WORKER_CONCURRENCY", "1")))
+
+# Run a worker inside the API process too. Turn off when dedicated workers
+# (worker.py) drain the queue.
+JOB_RUN_IN_API = os.getenv("JOB_RUN_IN_API", "true").lower() in ("1", "true", "yes")
+
+# Queued jobs accepted per lane before async uploads are turned away
+# (0 = unlimited), and the Retry-After sent back when that happens
+JOB_MAX_QUEUED = max(0, int(os.getenv("JOB_MAX_QUEUED", "0")))
+JOB_QUEUE_RETRY_AFTER_SECONDS = max(1, int(os.getenv("JOB_QUEUE_RETRY_AFTER_SECONDS", "30")))
+
+# Terminal states; "dead" jobs failed JOB_MAX_ATTEMPTS times
+FINISHED_STATUSES = ("done", "failed", "dead", "cancelled")
+
+_wake_up: Optional[asyncio.Event] = None
+_worker_tasks: set = set()
+
+
+def _collection():
+    return get_database().ocr_jobs
+
+
+def _get_wake_up() -> asyncio.Event:
+    global _wake_up
+    if _wake_up is None:
+        _wake_up = asyncio.Event()
+    return _wake_up
+
+
+async def ensure_job_indexes():
+    try:
+        await _collection().create_index([("status", 1), ("priority", 1), ("run_after", 1)])
+        await _collection().create_index([("status", 1), ("lease_until", 1)])
+    except Exception as e:
+        logger.error(f"Failed to create job queue indexes: {e}")
+
+
+async def enqueue(job: Dict) -> str:
+    """
+    Stores a new queued job and returns its id. job holds the job's own fields;
+    the queue bookkeeping fields are added here. Jobs with a lower priority
+    number are claimed first.
+    """
+    now = datetime.utcnow()
+    doc = {
+        "priority": 0,
+        **job,
+        "status": "queued",
+        "stage": "queued",
+        "attempts": 0,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "run_after": now,
+        "lease_until": None,
+        "worker_id": None,
+        "result": None,
+        "error": None,
+        "errors": [],
+        "created_at": now,
+        "updated_at": now,
+    }
+    job_id = str((await _collection().insert_one(doc)).inserted_id)
+    _get_wake_up().set()
+    return job_id
+
+
+async def count_queued(**filters) -> int:
+    return await _collection().count_documents({"status": "queued", **filters})
+
+
+async def queue_stats() -> Dict:
+    """
+    Jobs waiting and running, and how long the oldest queued job has waited.
+    """
+    oldest = await _collection().find_one({"status": "queued"}, sort=[("created_at", 1)])
+    return {
+        "queued": await count_queued(),
+        "processing": await _collection().count_documents({"status": "processing"}),
+        "dead": await _collection().count_documents({"status": "dead"}),
+        "oldest_queued_seconds": round((datetime.utcnow() - oldest["created_at"]).total_seconds(), 1)
+        if oldest else None,
+        "max_queued": JOB_MAX_QUEUED,
+    }
+
+
+async def claim_job(worker_id: str) -> Optional[Dict]:
+    """
+    Atomically takes the most urgent runnable job: a queued one whose backoff
+    has passed, or a processing one whose lease expired. Oldest first within
+    a priority.
+    """
+    while True:
+        now = datetime.utcnow()
+        job = await _collection().find_one_and_update(
+            {"$or": [
+                {"status": "queued", "run_after": {"$lte": now}},
+                {"status": "processing", "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": "processing",
+                    "stage": "started",
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", 1), ("run_after", 1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return None
+        # A job that kept killing its worker runs out of attempts here
+        if job["attempts"] > job["max_attempts"]:
+            await _finish(job, worker_id, status="dead", stage="dead",
+                          error=f"Lease expired after {job['max_attempts']} attempt(s)")
+            continue
+        return job
+
+
+async def update_job(job: Dict, owner: str, **fields) -> bool:
+    """
+    Updates a job the owner worker still holds. Returns False if the lease was lost.
+    """
+    fields["updated_at"] = datetime.utcnow()
+    result = await _collection().update_one({"_id": job["_id"], "worker_id": owner}, {"$set": fields})
+    return result.matched_count == 1
+
+
+async def request_cancel(job_filter: Dict) -> Optional[Dict]:
+    """
+    Cancels the job matching job_filter. A queued job (or one whose worker
+    died) is cancelled at once; a running one gets cancel_requested and its
+    worker stops at the next cancellable stage. Returns the job afterwards,
+    or None if there is no such job.
+    """
+    now = datetime.utcnow()
+    cancelled = {"$set": {"status": "cancelled", "stage": "cancelled", "worker_id": None,
+                          "lease_until": None, "cancel_requested": True, "updated_at": now}}
+    for idle in (
+        {"status": "queued"},
+        {"status": "processing", "lease_until": {"$lt": now}},
+    ):
+        job = await _collection().find_one_and_update(
+            {**job_filter, **idle}, cancelled, return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            return job
+    job = await _collection().find_one_and_update(
+        {**job_filter, "status": "processing"},
+        {"$set": {"cancel_requested": True, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is not None:
+        return job
+    # Already finished; nothing to cancel
+    return await _collection().find_one(job_filter)
+
+
+async def _watch(job: Dict, worker_id: str, task: asyncio.Task, state: Dict):
+    """
+    Renews the job's lease every JOB_HEARTBEAT_SECONDS and cancels task once
+    the job's cancellation is requested while its stage allows it. Also
+    cancels task when the lease is lost, or could not be renewed before it
+    ran out: another worker may be running the job by then.
+    """
+    loop = asyncio.get_running_loop()
+    next_heartbeat = loop.time() + JOB_HEARTBEAT_SECONDS
+    lease_deadline = loop.time() + JOB_LEASE_SECONDS
+    while True:
+        await asyncio.sleep(min(JOB_CANCEL_POLL_SECONDS, JOB_HEARTBEAT_SECONDS))
+        try:
+            if loop.time() >= next_heartbeat:
+                renewed_at = loop.time()
+                lease_until = datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+                if not await update_job(job, worker_id, lease_until=lease_until):
+                    logger.warning(f"Lost the lease on job {job['_id']}, stopping it")
+                    state["lost"] = True
+                    task.cancel()
+                    return
+                next_heartbeat = renewed_at + JOB_HEARTBEAT_SECONDS
+                lease_deadline = renewed_at + JOB_LEASE_SECONDS
+            if state["cancellable"] and await _collection().count_documents(
+                {"_id": job["_id"], "worker_id": worker_id, "cancel_requested": True}
+            ):
+                logger.info(f"Cancelling job {job['_id']} on request")
+                state["cancelled"] = True
+                task.cancel()
+                return
+        except Exception as e:
+            # Retried on the next tick until the lease runs out
+            logger.error(f"Heartbeat for job {job['_id']} failed: {e}")
+        if loop.time() >= lease_deadline:
+            logger.warning(f"Could not renew the lease on job {job['_id']} in time, stopping it")
+            state["lost"] = True
+            task.cancel()
+            return
+
+
+async def _finish(job: Dict, owner: str, **fields):
+    fields.setdefault("lease_until", None)
+    await update_job(job, owner, **fields)
+
+
+async def _release(job: Dict, owner: str):
+    now = datetime.utcnow()
+    try:
+        await _collection().update_one(
+            {"_id": job["_id"], "worker_id": owner},
+            {
+                "$set": {"status": "queued", "stage": "queued", "worker_id": None,
+                         "lease_until": None, "run_after": now, "updated_at": now},
+                "$inc": {"attempts": -1},
+            },
+        )
+    except Exception as e:
+        # The lease still expires and another worker picks the job up
+        logger.error(f"Could not release job {job['_id']}: {e}")
+
+
+async def _retry_or_dead_letter(job: Dict, worker_id: str, error: str):
+    errors = job.get("errors", []) + [{"attempt": job["attempts"], "error": error, "at": datetime.utcnow()}]
+    if job["attempts"] >= job["max_attempts"]:
+        logger.error(f"Job {job['_id']} failed {job['attempts']} time(s), dead-lettered: {error}")
+        await _finish(job, worker_id, status="dead", stage="dead", error=error, errors=errors)
+        return
+    delay = JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+    logger.warning(f"Job {job['_id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {error}")
+    await _finish(
+        job, worker_id, status="queued", stage="retrying", error=error, errors=errors,
+        worker_id=None, run_after=datetime.utcnow() + timedelta(seconds=delay)
+    )
+
+
+async def _cancel(job: Dict, worker_id: str, on_cancel: Optional[Callable[[Dict], Awaitable]]):
+    await _finish(job, worker_id, status="cancelled", stage="cancelled")
+    if on_cancel:
+        try:
+            await on_cancel(job)
+        except Exception as e:
+            logger.error(f"Cleanup of cancelled job {job['_id']} failed: {e}")
+
+
+async def run_job(
+    job: Dict,
+    worker_id: str,
+    handler: Callable[[Dict, Callable], Awaitable[Dict]],
+    on_cancel: Optional[Callable[[Dict], Awaitable]] = None
+):
+    """
+    Runs handler(job, progress) under a lease watcher and records the outcome.
+    progress(stage, cancellable=True) updates the job's stage while this
+    worker holds it; a requested cancellation interrupts the handler only
+    while the current stage is cancellable, and on_cancel(job) then cleans up.
+    """
+    if job.get("cancel_requested"):
+        # Its previous worker died before it could stop
+        await _cancel(job, worker_id, on_cancel)
+        return
+
+    state = {"cancellable": True, "cancelled": False, "lost": False}
+
+    async def progress(stage: str, cancellable: bool = True):
+        state["cancellable"] = cancellable
+        await update_job(job, worker_id, stage=stage)
+
+    task = asyncio.create_task(handler(job, progress))
+    watcher = asyncio.create_task(_watch(job, worker_id, task, state))
+    try:
+        result = await task
+    except asyncio.CancelledError:
+        if state["lost"]:
+            # The job now belongs to the worker that claimed it next; leave its
+            # record alone, but still stop if this worker is shutting down too
+            if asyncio.current_task().cancelling():
+                raise
+            return
+        if not state["cancelled"]:
+            # Shutting down: hand the job back without using up an attempt
+            task.cancel()
+            await _release(job, worker_id)
+            raise
+        await _cancel(job, worker_id, on_cancel)
+    except Exception as e:
+        await _retry_or_dead_letter(job, worker_id, str(e))
+    else:
+        await _finish(job, worker_id, status="done", stage="done", result=result, error=None)
+    finally:
+        watcher.cancel()
+
+
+async def _worker_loop(worker_id: str, handler, on_cancel=None):
+    wake_up = _get_wake_up()
+    while True:
+        # Cleared before claiming, so a job enqueued meanwhile is not missed
+        wake_up.clear()
+        try:
+            job = await claim_job(worker_id)
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(wake_up.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job, worker_id, handler, on_cancel)
+
+
+def start_workers(handler, concurrency: int = JOB_WORKER_CONCURRENCY, on_cancel=None) -> str:
+    """
+    Starts concurrency worker loops in the running event loop (see run_job
+    for handler and on_cancel). Returns the worker id prefix (host and pid)
+    used for their leases.
+    """
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    for slot in range(concurrency):
+        worker_id = f"{prefix}:{slot}:{uuid.uuid4().hex[:6]}"
+        task = asyncio.create_task(_worker_loop(worker_id, handler, on_cancel))
+        _worker_tasks.add(task)
+        task.add_done_callback(_worker_tasks.discard)
+    logger.info(f"Started {concurrency} job worker(s) ({prefix})")
+    return prefix
+
+
+async def stop_workers():
+    """
+    Stops the worker loops; jobs they were running go back to the queue.
+    """
+    tasks = list(_worker_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
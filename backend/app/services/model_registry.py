@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Lazily loads named model variants and keeps them in memory, least recently
+    used first.
+
+    Loading happens under a per-name lock, so concurrent first requests for
+    the same variant build it once while other variants stay available. When
+    memory_budget_mb is set and the loaded variants add up to more than that,
+    the least recently used ones are dropped (the one just requested is always
+    kept, even if it alone exceeds the budget).
+    """
+    def __init__(self, loader: Callable[[str], Any], sizeof: Callable[[Any], int], memory_budget_mb: float = 0):
+        self._loader = loader
+        self._sizeof = sizeof
+        self.memory_budget = int(memory_budget_mb * 1e6)
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        # Bytes held by each loaded variant
+        self.footprints: Dict[str, int] = {}
+        # Seconds spent on the last load of each variant
+        self.load_seconds: Dict[str, float] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name]
+
+            start = time.perf_counter()
+            model = self._loader(name)
+            elapsed = time.perf_counter() - start
+            size = self._sizeof(model)
+
+            with self._lock:
+                self._models[name] = model
+                self.footprints[name] = size
+                self.load_seconds[name] = elapsed
+                self._evict(keep=name)
+            return model
+
+    def _evict(self, keep: str):
+        if self.memory_budget <= 0:
+            return
+        while self.total_bytes() > self.memory_budget:
+            victim = next((name for name in self._models if name != keep), None)
+            if victim is None:
+                break
+            del self._models[victim]
+            freed = self.footprints.pop(victim, 0)
+            logger.info(f"Evicted model '{victim}' ({freed / 1e6:.0f} MB) to stay within the memory budget")
+
+    def evict(self, name: str):
+        with self._lock:
+            self._models.pop(name, None)
+            self.footprints.pop(name, None)
+
+    def total_bytes(self) -> int:
+        return sum(self.footprints.values())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "loaded": list(self._models),
+                "footprint_mb": {name: round(size / 1e6, 1) for name, size in self.footprints.items()},
+                "total_mb": round(self.total_bytes() / 1e6, 1),
+                "budget_mb": round(self.memory_budget / 1e6, 1) if self.memory_budget else None,
+            }
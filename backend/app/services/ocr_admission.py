@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from app.services.ocr_executor import OCR_BATCH_MAX_SIZE, OCR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Uploads allowed in OCR at once. Every admitted upload holds its decoded
+# image (and crops) until its results come back, so this bounds memory.
+# The default keeps every worker busy with full batches.
+OCR_MAX_CONCURRENT = max(1, int(os.getenv("OCR_MAX_CONCURRENT", str(OCR_WORKERS * OCR_BATCH_MAX_SIZE))))
+
+# Uploads allowed to wait for a slot, per lane. Beyond that they are turned
+# away with Retry-After instead of piling up in memory.
+OCR_QUEUE_DEPTH = max(0, int(os.getenv("OCR_QUEUE_DEPTH", "16")))
+OCR_BULK_QUEUE_DEPTH = max(0, int(os.getenv("OCR_BULK_QUEUE_DEPTH", "64")))
+
+# Interactive uploads (a user waiting on the screen) always get the next free
+# slot before bulk/backfill work
+LANES = ("interactive", "bulk")
+
+# Wait and service times kept for the stats and the Retry-After estimate
+_WINDOW = 200
+
+
+class AdmissionQueueFull(Exception):
+    """
+    Raised when an upload cannot even wait for an OCR slot. retry_after is the
+    suggested delay in seconds before trying again.
+    """
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"OCR queue full ({lane}), retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded, prioritised admission to OCR: at most max_concurrent holders at a
+    time, a queue of bounded depth per lane, strict priority in LANES order.
+    """
+    def __init__(self, max_concurrent: int, queue_depths: Dict[str, int]):
+        self.max_concurrent = max_concurrent
+        self.queue_depths = queue_depths
+        self.in_flight = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._waits: Dict[str, Deque[float]] = {lane: deque(maxlen=_WINDOW) for lane in LANES}
+        self._service_times: Deque[float] = deque(maxlen=_WINDOW)
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+        self._enqueued_at: Dict[asyncio.Future, float] = {}
+
+    def retry_after(self, lane: str) -> int:
+        # Time for the uploads ahead of this one to drain, from recent service times
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        ahead = self.in_flight + sum(
+            len(self._waiters[l]) for l in LANES[:LANES.index(lane) + 1]
+        )
+        return max(1, math.ceil(service * ahead / self.max_concurrent))
+
+    async def _acquire(self, lane: str, block: bool) -> float:
+        """
+        Takes a slot in lane, waiting behind earlier and higher priority
+        uploads. Returns the seconds spent waiting.
+        """
+        if self.in_flight < self.max_concurrent and not any(self._waiters.values()):
+            self.in_flight += 1
+            self._admitted[lane] += 1
+            self._waits[lane].append(0.0)
+            return 0.0
+        if not block and len(self._waiters[lane]) >= self.queue_depths[lane]:
+            self._rejected[lane] += 1
+            raise AdmissionQueueFull(lane, self.retry_after(lane))
+
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        self._enqueued_at[waiter] = start
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            elif waiter in self._waiters[lane]:
+                # Not yet popped by a _release that ran between cancel and resume
+                self._waiters[lane].remove(waiter)
+            raise
+        finally:
+            self._enqueued_at.pop(waiter, None)
+        waited = time.perf_counter() - start
+        self._admitted[lane] += 1
+        self._waits[lane].append(waited)
+        return waited
+
+    def _release(self):
+        # Hand the slot straight to the next waiter, highest priority lane first
+        for lane in LANES:
+            while self._waiters[lane]:
+                waiter = self._waiters[lane].popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, lane: str = "interactive", block: bool = False):
+        """
+        Holds one OCR slot for the body of the with block. Raises
+        AdmissionQueueFull when lane's queue is full, unless block is set
+        (callers that are already bounded, like job workers, wait instead).
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown OCR lane '{lane}'. Choose from: {', '.join(LANES)}")
+        await self._acquire(lane, block)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._service_times.append(time.perf_counter() - start)
+            self._release()
+
+    def stats(self) -> Dict:
+        now = time.perf_counter()
+        lanes = {}
+        for lane in LANES:
+            waits = sorted(self._waits[lane])
+            oldest = min(
+                (self._enqueued_at[w] for w in self._waiters[lane] if w in self._enqueued_at),
+                default=None
+            )
+            lanes[lane] = {
+                "queued": len(self._waiters[lane]),
+                "queue_depth": self.queue_depths[lane],
+                "admitted": self._admitted[lane],
+                "rejected": self._rejected[lane],
+                "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else None,
+                "p95_wait_ms": round(1000 * waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else None,
+                "oldest_wait_ms": round(1000 * (now - oldest), 1) if oldest is not None else None,
+            }
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "avg_service_ms": round(1000 * sum(self._service_times) / len(self._service_times), 1)
+            if self._service_times else None,
+            "lanes": lanes,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            OCR_MAX_CONCURRENT,
+            {"interactive": OCR_QUEUE_DEPTH, "bulk": OCR_BULK_QUEUE_DEPTH},
+        )
+        logger.info(
+            f"OCR admission: {OCR_MAX_CONCURRENT} concurrent, queue depth "
+            f"{OCR_QUEUE_DEPTH} interactive / {OCR_BULK_QUEUE_DEPTH} bulk"
+        )
+    return _controller
+
+
+def admission_stats() -> Dict:
+    return get_admission().stats()
@@ -0,0 +1,129 @@
+import copy
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.database import get_database
+from app.services.ocr_profiles import OCR_PROFILES, active_profiles
+
+logger = logging.getLogger(__name__)
+
+# Number of uploads whose parsed results are kept in the in-process LRU in front of Mongo
+OCR_CACHE_SIZE = max(0, int(os.getenv("OCR_CACHE_SIZE", "256")))
+
+# How long a parsed upload is reused before it is OCR'd again
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Bump when a change to the OCR or parsing code should invalidate cached results
+OCR_CACHE_SCHEMA = 1
+
+# OCR_* settings that only affect how fast or where OCR runs, not what it
+# returns. Every other OCR_* variable is part of the cache version, so a new
+# setting invalidates cached results unless it is listed here.
+_NON_OUTPUT_SETTINGS = frozenset((
+    "OCR_WORKERS", "OCR_CPU_AFFINITY", "OCR_WARMUP", "OCR_BATCH_MAX_SIZE", "OCR_BATCH_MAX_WAIT_MS",
+    "OCR_MAX_CONCURRENT", "OCR_QUEUE_DEPTH", "OCR_BULK_QUEUE_DEPTH", "OCR_CACHE_SIZE",
+    "OCR_CACHE_TTL_SECONDS", "OCR_MODEL_CACHE_DIR", "OCR_MODEL_MEMORY_MB", "OCR_WEIGHTS_DIR",
+    "OCR_TIMING_LOG_EVERY",
+))
+
+# content hash -> one analyze_text result per receipt found in the upload
+_lru: "OrderedDict[str, List[Dict]]" = OrderedDict()
+
+
+def content_hash(image_content: bytes) -> str:
+    return hashlib.sha256(image_content).hexdigest()
+
+
+def pipeline_version() -> str:
+    """
+    Fingerprint of the code and configuration that produced a cache entry.
+    Entries written under another version are treated as misses.
+    """
+    parts = [str(OCR_CACHE_SCHEMA)]
+    parts += [f"{profile}={'+'.join(OCR_PROFILES.get(profile, ()))}" for profile in active_profiles()]
+    # Read from the environment so this module doesn't import ocr_service and torch
+    parts += [f"{name}={value}" for name, value in sorted(os.environ.items())
+              if name.startswith("OCR_") and name not in _NON_OUTPUT_SETTINGS]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()[:16]
+
+
+_PIPELINE_VERSION = pipeline_version()
+
+
+def _remember(key: str, results: List[Dict]):
+    if OCR_CACHE_SIZE == 0:
+        return
+    _lru[key] = results
+    _lru.move_to_end(key)
+    while len(_lru) > OCR_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+def _is_cacheable(results: List[Dict]) -> bool:
+    # Only cache real ReceiptAnalyzer output, never OCR failures
+    return bool(results) and all(r and "confidence" in r for r in results)
+
+
+async def ensure_cache_indexes():
+    db = get_database()
+    try:
+        await db.ocr_cache.create_index("content_hash", unique=True)
+        # Mongo drops each entry once its expires_at has passed
+        await db.ocr_cache.create_index("expires_at", expireAfterSeconds=0)
+        # Entries from before versioning can never be hit and would never expire
+        await db.ocr_cache.delete_many({"expires_at": {"$exists": False}})
+        await db.receipts.create_index([("user_id", 1), ("content_hash", 1)])
+    except Exception as e:
+        logger.error(f"Failed to create OCR cache indexes: {e}")
+
+
+async def get_cached_results(key: str) -> Optional[List[Dict]]:
+    """
+    Returns a copy of the cached analyze_text output(s) for this content hash,
+    one per receipt in the upload, or None. Entries from another pipeline
+    version are ignored; the next store_results overwrites them.
+    """
+    if key in _lru:
+        _lru.move_to_end(key)
+        return copy.deepcopy(_lru[key])
+
+    db = get_database()
+    doc = await db.ocr_cache.find_one({"content_hash": key, "pipeline_version": _PIPELINE_VERSION})
+    if not doc:
+        return None
+
+    results = doc["results"]
+    _remember(key, results)
+    return copy.deepcopy(results)
+
+
+async def store_results(key: str, results: List[Dict]):
+    if not _is_cacheable(results):
+        return
+
+    _remember(key, copy.deepcopy(results))
+
+    db = get_database()
+    now = datetime.utcnow()
+    try:
+        await db.ocr_cache.update_one(
+            {"content_hash": key},
+            {
+                "$set": {
+                    "results": results,
+                    "pipeline_version": _PIPELINE_VERSION,
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=OCR_CACHE_TTL_SECONDS),
+                },
+                "$unset": {"parsed_data": ""},
+                "$setOnInsert": {"created_at": now},
+            },
+            upsert=True,
+        )
+    except Exception as e:
+        # The cache is an optimisation; never fail an upload because of it
+        logger.error(f"Failed to store OCR cache entry: {e}")
@@ -0,0 +1,429 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.services.ocr_profiles import OCR_BATCH_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Number of OCR worker processes. Each worker loads its own doctr predictor,
+# so memory grows roughly linearly with this value.
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", "1")))
+
+# Intra-op threads for torch and OpenCV in each worker. By default the cores
+# are split evenly between workers so concurrent inferences do not fight over them.
+OCR_THREADS_PER_WORKER = max(1, int(os.getenv(
+    "OCR_THREADS_PER_WORKER", str(max(1, (os.cpu_count() or 1) // OCR_WORKERS))
+)))
+# Pin each worker to its own block of OCR_THREADS_PER_WORKER cores (Linux only)
+OCR_CPU_AFFINITY = os.getenv("OCR_CPU_AFFINITY", "false").lower() in ("1", "true", "yes")
+
+# Micro-batching: uploads arriving within OCR_BATCH_MAX_WAIT_MS of each other
+# are sent to a worker together (up to OCR_BATCH_MAX_SIZE) and run in one
+# forward pass.
+OCR_BATCH_MAX_WAIT_MS = max(0.0, float(os.getenv("OCR_BATCH_MAX_WAIT_MS", "25")))
+
+# Detect several receipts photographed together and OCR each one separately.
+# Off by default: other bright objects in the frame can pass for a receipt.
+OCR_MULTI_RECEIPT = os.getenv("OCR_MULTI_RECEIPT", "false").lower() in ("1", "true", "yes")
+
+# Load the model and run a dummy inference in every worker at startup,
+# instead of on the first upload
+OCR_WARMUP = os.getenv("OCR_WARMUP", "false").lower() in ("1", "true", "yes")
+
+# Averaged per-stage timings are logged once every this many receipts
+OCR_TIMING_LOG_EVERY = max(1, int(os.getenv("OCR_TIMING_LOG_EVERY", "50")))
+
+# Tickets of abandoned OCR requests, shared with the workers. The newest
+# _CANCEL_SLOTS cancellations are kept, far more than can be in flight.
+_CANCEL_SLOTS = 256
+
+_executor: Optional[ProcessPoolExecutor] = None
+_cancelled_tickets = None
+_cancel_cursor = 0
+_tickets = itertools.count(1)
+_batcher: Optional["OCRBatcher"] = None
+_warmup_task: Optional[asyncio.Task] = None
+
+# Readiness of the OCR pipeline, served by /api/health/ocr
+ocr_status = {
+    "mode": "eager" if OCR_WARMUP else "lazy",
+    "ready": False,
+    "warming_up": False,
+    "workers": OCR_WORKERS,
+    "threads_per_worker": OCR_THREADS_PER_WORKER,
+    "workers_warm": 0,
+    "load_seconds": None,
+    "warmup_seconds": None,
+    # Weights held by the loaded predictors in one worker
+    "model_memory_mb": None,
+    "startup_seconds": None,
+    "error": None,
+    # Receipts served per OCR tier, and forward passes spent on them
+    "tiers": {},
+    "ocr_passes": 0,
+    "receipts_processed": 0,
+}
+
+
+def _apply_thread_budget(worker_index: int, threads: int, affinity: bool):
+    """
+    Limits this worker to its share of the CPU. Must run before torch is
+    imported for the OpenMP setting to take effect.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    if affinity and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        first = (worker_index * threads) % len(cores)
+        block = [cores[(first + i) % len(cores)] for i in range(min(threads, len(cores)))]
+        os.sched_setaffinity(0, block)
+
+    import cv2
+    import torch
+    cv2.setNumThreads(threads)
+    torch.set_num_threads(threads)
+    try:
+        # Batches are run one at a time per worker; inter-op parallelism only adds contention
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def _ticket_checker(cancelled_tickets):
+    def is_cancelled(ticket: int) -> bool:
+        with cancelled_tickets.get_lock():
+            return ticket in cancelled_tickets[:]
+    return is_cancelled
+
+
+def _init_worker(
+    worker_counter=None,
+    threads: int = OCR_THREADS_PER_WORKER,
+    affinity: bool = OCR_CPU_AFFINITY,
+    cancelled_tickets=None
+):
+    """
+    Runs once in every worker process: apply the thread budget, then load the
+    predictor up front so requests never pay for model construction.
+    """
+    worker_index = 0
+    if worker_counter is not None:
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+    _apply_thread_budget(worker_index, threads, affinity)
+
+    from app.services.ocr_service import get_model, warm_up, set_cancel_check
+    from app.utils.ocr_log import log_error
+    if cancelled_tickets is not None:
+        set_cancel_check(_ticket_checker(cancelled_tickets))
+    try:
+        if OCR_WARMUP:
+            warm_up()
+        else:
+            get_model()
+    except Exception as e:
+        # Leave the worker alive; extract_text will retry the load and report
+        log_error("OCR worker failed to preload model", e)
+
+
+def _ocr_task(image_content: Union[bytes, np.ndarray], ticket: Optional[int] = None) -> Dict:
+    # Imported here so the API process does not need to touch the model
+    from app.services.ocr_service import extract_text
+    return extract_text(image_content, ticket=ticket)
+
+
+def _split_regions_task(image_content: bytes) -> List[np.ndarray]:
+    from app.services.ocr_service import split_receipt_regions
+    return split_receipt_regions(image_content)
+
+
+def _warm_up_task() -> Dict:
+    from app.services.ocr_service import warm_up
+    return warm_up()
+
+
+def _ocr_batch_task(image_contents: List[Union[bytes, np.ndarray]], tickets: Optional[List[int]] = None) -> List[Dict]:
+    from app.services.ocr_service import extract_text_batch
+    return extract_text_batch(image_contents, tickets=tickets)
+
+
+def cancel_ticket(ticket: int):
+    """
+    Marks an OCR request as abandoned. The worker running it stops at its next
+    stage boundary (see extract_text_batch).
+    """
+    global _cancel_cursor
+    if _cancelled_tickets is None:
+        return
+    with _cancelled_tickets.get_lock():
+        _cancelled_tickets[_cancel_cursor % _CANCEL_SLOTS] = ticket
+        _cancel_cursor += 1
+
+
+class OCRBatcher:
+    """
+    Collects OCR requests into batches and fans the results back out.
+
+    At most one batch per worker is in flight. While every worker is busy,
+    new requests keep queueing, so batches grow with load and stay small
+    (low latency) when the service is idle.
+    """
+    def __init__(self, max_batch_size: int, max_wait_ms: float, max_in_flight: int):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._collect_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def submit(self, image_content: Union[bytes, np.ndarray], ticket: Optional[int] = None) -> Dict:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_content, ticket, future))
+        return await future
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        # Still take whatever is already waiting
+                        if self._queue.empty():
+                            break
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Union[bytes, np.ndarray], Optional[int], asyncio.Future]]):
+        try:
+            # Requests whose caller already went away are not worth running
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                return
+            if len(batch) > 1:
+                logger.info(f"Running OCR batch of {len(batch)} receipts")
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    get_executor(), _ocr_batch_task,
+                    [content for content, _, _ in batch], [ticket for _, ticket, _ in batch]
+                )
+            except BrokenProcessPool as e:
+                logger.error("OCR process pool is broken, restarting it")
+                _discard_executor()
+                results = [e] * len(batch)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+def get_batcher() -> "OCRBatcher":
+    global _batcher
+    if _batcher is None:
+        _batcher = OCRBatcher(OCR_BATCH_MAX_SIZE, OCR_BATCH_MAX_WAIT_MS, OCR_WORKERS)
+        _batcher.start()
+    return _batcher
+
+
+# Running sums of stage timings since the last aggregate log line
+_timing_totals: Dict[str, float] = {}
+_timing_counts: Dict[str, int] = {}
+_timed_receipts = 0
+
+
+def _aggregate_timings(timings: Dict[str, float]):
+    global _timed_receipts
+    for stage, ms in timings.items():
+        _timing_totals[stage] = _timing_totals.get(stage, 0.0) + ms
+        _timing_counts[stage] = _timing_counts.get(stage, 0) + 1
+    _timed_receipts += 1
+
+    if _timed_receipts >= OCR_TIMING_LOG_EVERY:
+        averages = ", ".join(
+            f"{stage}={_timing_totals[stage] / _timing_counts[stage]:.1f}" for stage in _timing_totals
+        )
+        logger.info(f"OCR stage timings, avg ms over {_timed_receipts} receipts: {averages}")
+        _timing_totals.clear()
+        _timing_counts.clear()
+        _timed_receipts = 0
+
+
+def _record_result(result: Dict):
+    ocr_status["ready"] = True
+    if result.get("timings"):
+        _aggregate_timings(result["timings"])
+    tier = result.get("ocr_tier")
+    if not tier:
+        return
+    ocr_status["tiers"][tier] = ocr_status["tiers"].get(tier, 0) + 1
+    ocr_status["ocr_passes"] += result.get("ocr_passes", 1)
+    ocr_status["receipts_processed"] += 1
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor, _cancelled_tickets
+    if _executor is None:
+        # spawn: torch is not fork-safe once its thread pools are started
+        ctx = multiprocessing.get_context("spawn")
+        _cancelled_tickets = ctx.Array("q", _CANCEL_SLOTS)
+        _executor = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=ctx,
+            initializer=_init_worker,
+            # Hands every worker a distinct index for CPU affinity
+            initargs=(ctx.Value("i", 0), OCR_THREADS_PER_WORKER, OCR_CPU_AFFINITY, _cancelled_tickets),
+        )
+        logger.info(
+            f"OCR executor started with {OCR_WORKERS} worker process(es), "
+            f"{OCR_THREADS_PER_WORKER} thread(s) each"
+        )
+    return _executor
+
+
+async def warm_up_workers():
+    """
+    Starts every OCR worker and waits until they have loaded the model and run
+    a dummy inference. Progress is tracked in ocr_status.
+    """
+    loop = asyncio.get_running_loop()
+    ocr_status["warming_up"] = True
+    ocr_status["error"] = None
+    start = time.perf_counter()
+    try:
+        # One task per worker; the pool spawns a process for each, and every
+        # process warms up in its initializer before taking any task
+        results = await asyncio.gather(*[
+            loop.run_in_executor(get_executor(), _warm_up_task) for _ in range(OCR_WORKERS)
+        ])
+        ocr_status["workers_warm"] = len({r["pid"] for r in results})
+        ocr_status["load_seconds"] = max(r["load_seconds"] for r in results)
+        ocr_status["warmup_seconds"] = max(r["warmup_seconds"] for r in results)
+        ocr_status["model_memory_mb"] = max(r["models"]["total_mb"] for r in results)
+        ocr_status["ready"] = True
+        logger.info(f"OCR warm-up finished in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        ocr_status["error"] = str(e)
+        logger.error(f"OCR warm-up failed: {e}")
+    finally:
+        ocr_status["startup_seconds"] = round(time.perf_counter() - start, 3)
+        ocr_status["warming_up"] = False
+
+
+def start_warm_up():
+    """
+    Kicks off warm_up_workers in the background so the API (and the readiness
+    probe) can answer while the model loads.
+    """
+    global _warmup_task
+    if _warmup_task is None or _warmup_task.done():
+        _warmup_task = asyncio.create_task(warm_up_workers())
+
+
+def _discard_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown_executor():
+    global _batcher, _warmup_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _warmup_task = None
+    if _batcher is not None:
+        _batcher.stop()
+        _batcher = None
+    _discard_executor()
+    logger.info("OCR executor stopped")
+
+
+async def split_regions(image_content: bytes) -> List[np.ndarray]:
+    """
+    Crops of each receipt when the photo holds several (see
+    split_receipt_regions), computed in the OCR process pool. Empty for
+    ordinary single-receipt photos or when OCR_MULTI_RECEIPT is off.
+    """
+    if not OCR_MULTI_RECEIPT:
+        return []
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), _split_regions_task, image_content)
+    except BrokenProcessPool:
+        logger.error("OCR process pool is broken, restarting it")
+        _discard_executor()
+        raise
+
+
+async def run_ocr(image_content: Union[bytes, np.ndarray]) -> Dict:
+    """
+    Runs extract_text in the OCR process pool without blocking the event loop.
+    Accepts uploaded file bytes or an already decoded image (a region crop).
+    Cancelling the caller drops the request if it has not started, and stops
+    it at the next stage boundary if it has.
+    """
+    ticket = next(_tickets)
+    try:
+        if OCR_BATCH_MAX_SIZE > 1:
+            result = await get_batcher().submit(image_content, ticket)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(
+                get_executor(), _ocr_task, image_content, ticket
+            )
+        _record_result(result)
+        return result
+    except asyncio.CancelledError:
+        cancel_ticket(ticket)
+        raise
+    except BrokenProcessPool:
+        # A worker died (OOM, segfault in native code). Drop the pool so the
+        # next request gets a fresh one, and fail this request.
+        logger.error("OCR process pool is broken, restarting it")
+        _discard_executor()
+        raise
@@ -0,0 +1,41 @@
+import os
+from typing import List
+
+# Detector / recognizer pairs, from most accurate to fastest
+OCR_PROFILES = {
+    "accurate": ("db_resnet50", "crnn_vgg16_bn"),
+    "balanced": ("db_resnet50", "crnn_mobilenet_v3_large"),
+    "fast": ("db_mobilenet_v3_large", "crnn_mobilenet_v3_small"),
+}
+OCR_PROFILE = os.getenv("OCR_PROFILE", "accurate")
+
+# Cascade: read every receipt with the fast profile and only re-run the heavy
+# profile when merchant, amount or date is missing or confidence is too low
+OCR_CASCADE = os.getenv("OCR_CASCADE", "false").lower() in ("1", "true", "yes")
+OCR_CASCADE_FAST_PROFILE = os.getenv("OCR_CASCADE_FAST_PROFILE", "fast")
+OCR_CASCADE_HEAVY_PROFILE = os.getenv("OCR_CASCADE_HEAVY_PROFILE", "accurate")
+OCR_CASCADE_MIN_CONFIDENCE = float(os.getenv("OCR_CASCADE_MIN_CONFIDENCE", "0.75"))
+
+# Pages per forward pass: the executor sends up to this many uploads to a
+# worker together, and the detector runs them in one batch.
+# OCR_BATCH_MAX_SIZE=1 disables batching.
+OCR_BATCH_MAX_SIZE = max(1, int(os.getenv("OCR_BATCH_MAX_SIZE", "4")))
+
+
+def active_profiles() -> List[str]:
+    """
+    Profiles the current configuration runs: both tiers in cascade mode.
+    """
+    if OCR_CASCADE:
+        return [OCR_CASCADE_FAST_PROFILE, OCR_CASCADE_HEAVY_PROFILE]
+    return [OCR_PROFILE]
+
+
+def active_archs() -> List[str]:
+    """
+    Detector and recognizer architectures of the active profiles.
+    """
+    for profile in active_profiles():
+        if profile not in OCR_PROFILES:
+            raise ValueError(f"Unknown OCR profile '{profile}'. Available: {', '.join(OCR_PROFILES)}")
+    return sorted({arch for profile in active_profiles() for arch in OCR_PROFILES[profile]})
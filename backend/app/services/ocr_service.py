@@ -1,73 +1,322 @@
 import cv2
+import io
 import numpy as np
-from doctr.io import DocumentFile
+from PIL import Image
 from doctr.models import ocr_predictor
 import re
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple, Union
 from datetime import datetime
-import tempfile
 import os
+import time
 
 import torch
+
+from app.services.model_registry import ModelRegistry
+from app.utils.ocr_log import log_error, log_to_file
+from app.services.weight_store import OCR_WEIGHTS_DIR, weight_path
 # device = torch.device("cpu") # Move inside function
 
-# Global model variable
-model = None
+# Profiles, cascade and batch settings live in ocr_profiles so the API process can read them without torch
+from app.services.ocr_profiles import (
+    OCR_BATCH_MAX_SIZE, OCR_CASCADE, OCR_CASCADE_FAST_PROFILE, OCR_CASCADE_HEAVY_PROFILE,
+    OCR_CASCADE_MIN_CONFIDENCE, OCR_PROFILE, OCR_PROFILES, active_profiles
+)
 
-def log_to_file(msg):
-    try:
-        with open("D:/ReceiptAnalyzer/backend/ocr_debug.log", "a") as f:
-            f.write(f"{datetime.now()} - {msg}\n")
-    except:
-        pass
-
-def get_model():
-    global model
-    if model is None:
-        log_to_file("Starting model initialization...")
+# Inference backend. "torch" runs the float32 models eagerly; "int8" applies
+# dynamic int8 quantization once and caches the quantized weights on disk,
+# so later starts load them directly instead of quantizing again. Only the
+# Linear/LSTM layers are quantized, so the gain is small: about 4 MB less
+# weight memory per profile and ~3% faster on "accurate", no speedup on
+# "fast". It relies on torch.ao.quantization, deprecated by torch (see the
+# torch pin in requirements.txt).
+OCR_BACKENDS = ("torch", "int8")
+OCR_BACKEND = os.getenv("OCR_BACKEND", "torch")
+OCR_MODEL_CACHE_DIR = os.getenv("OCR_MODEL_CACHE_DIR", "model_cache")
+
+# RAM budget for loaded predictors per process. When loading another profile
+# would exceed it, the least recently used profiles are unloaded. 0 = unbounded.
+# In cascade mode both tiers count towards the budget.
+OCR_MODEL_MEMORY_MB = float(os.getenv("OCR_MODEL_MEMORY_MB", "0"))
+
+# Resolution policy for preprocessing: images taller than OCR_MAX_HEIGHT are
+# scaled down to OCR_TARGET_HEIGHT, shorter than OCR_MIN_HEIGHT scaled up to it
+OCR_MIN_HEIGHT = int(os.getenv("OCR_MIN_HEIGHT", "1400"))
+OCR_TARGET_HEIGHT = int(os.getenv("OCR_TARGET_HEIGHT", "1800"))
+OCR_MAX_HEIGHT = int(os.getenv("OCR_MAX_HEIGHT", "2400"))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", "4000000"))
+
+# Tiling for long receipts: pages taller than OCR_TILE_ASPECT x their width
+# are resized to OCR_TILE_WIDTH wide and read as overlapping strips
+OCR_TILE_ASPECT = float(os.getenv("OCR_TILE_ASPECT", "3.0"))
+OCR_TILE_WIDTH = int(os.getenv("OCR_TILE_WIDTH", "1000"))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1800"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+OCR_TILE_MAX_TILES = int(os.getenv("OCR_TILE_MAX_TILES", "12"))
+
+# Longest side of the downsampled copy used to estimate skew
+OCR_DESKEW_MAX_SIDE = int(os.getenv("OCR_DESKEW_MAX_SIDE", "600"))
+
+# Preprocessing stages to run, in order (see PREPROCESS_STAGES). Drop a name
+# to disable that stage. Put "probe" in front of the enhancement stages to
+# skip CLAHE, denoising and sharpening on images that do not need them.
+OCR_PREPROCESS_PIPELINE = os.getenv("OCR_PREPROCESS_PIPELINE", "crop,resize,deskew,grayscale,clahe,denoise,sharpen")
+
+# Receipt cropping: the paper must cover this fraction of the photo to be
+# cropped to (outside the range the photo is assumed to be a scan already)
+OCR_CROP_MAX_SIDE = int(os.getenv("OCR_CROP_MAX_SIDE", "800"))
+OCR_CROP_MIN_AREA = float(os.getenv("OCR_CROP_MIN_AREA", "0.1"))
+OCR_CROP_MAX_AREA = float(os.getenv("OCR_CROP_MAX_AREA", "0.9"))
+
+# Several receipts in one photo: each paper region must cover at least this
+# fraction of the frame to count as a receipt
+OCR_MULTI_MIN_AREA = float(os.getenv("OCR_MULTI_MIN_AREA", "0.04"))
+OCR_MULTI_MAX_REGIONS = int(os.getenv("OCR_MULTI_MAX_REGIONS", "8"))
+# ...and look like printed paper: at least this fraction of its pixels must be
+# ink (blank napkins, glare, phone screens have none), and its long side may
+# be at most OCR_MULTI_MAX_ASPECT times its short side
+OCR_MULTI_MIN_INK = float(os.getenv("OCR_MULTI_MIN_INK", "0.02"))
+OCR_MULTI_MAX_INK = float(os.getenv("OCR_MULTI_MAX_INK", "0.5"))
+OCR_MULTI_MAX_ASPECT = float(os.getenv("OCR_MULTI_MAX_ASPECT", "8"))
+
+# Quality probe thresholds: skip CLAHE at or above this contrast, denoising at
+# or below this noise level, sharpening at or above this Laplacian variance
+OCR_PROBE_MAX_SIDE = int(os.getenv("OCR_PROBE_MAX_SIDE", "512"))
+OCR_PROBE_CONTRAST_MIN = float(os.getenv("OCR_PROBE_CONTRAST_MIN", "150"))
+OCR_PROBE_NOISE_MAX = float(os.getenv("OCR_PROBE_NOISE_MAX", "3.0"))
+OCR_PROBE_SHARPNESS_MIN = float(os.getenv("OCR_PROBE_SHARPNESS_MIN", "10000"))
+
+# Set in OCR worker processes: tells whether the request holding a ticket was
+# abandoned (see ocr_executor.cancel_ticket)
+_cancel_check: Optional[Callable[[int], bool]] = None
+
+
+class OCRCancelled(Exception):
+    """
+    Raised at a stage boundary when the request was abandoned.
+    """
+
+
+def set_cancel_check(check: Optional[Callable[[int], bool]]):
+    global _cancel_check
+    _cancel_check = check
+
+
+def _pretrained_predictor(det_arch: str, reco_arch: str):
+    """
+    Builds a predictor with pretrained weights: from the local weight store
+    when OCR_WEIGHTS_DIR is set, otherwise downloaded by doctr.
+    """
+    if not OCR_WEIGHTS_DIR:
+        return ocr_predictor(det_arch=det_arch, reco_arch=reco_arch, pretrained=True, det_bs=OCR_BATCH_MAX_SIZE)
+
+    # Resolve and verify both files before building anything
+    det_path, reco_path = weight_path(det_arch), weight_path(reco_arch)
+    # pretrained_backbone=False too, or doctr would fetch the backbone weights
+    predictor = ocr_predictor(
+        det_arch=det_arch, reco_arch=reco_arch, pretrained=False,
+        pretrained_backbone=False, det_bs=OCR_BATCH_MAX_SIZE
+    )
+    predictor.det_predictor.model.from_pretrained(det_path)
+    predictor.reco_predictor.model.from_pretrained(reco_path)
+    return predictor
+
+def _quantize_int8(predictor):
+    """
+    Dynamic int8 quantization of the detection and recognition models. Only
+    Linear and LSTM layers have dynamic int8 kernels, so this mostly speeds up
+    the recognition head; the convolutional layers stay float32.
+    """
+    quantization = getattr(getattr(torch, "ao", None), "quantization", None)
+    if quantization is None or not hasattr(quantization, "quantize_dynamic"):
+        raise RuntimeError(
+            f"OCR_BACKEND=int8 needs torch.ao.quantization.quantize_dynamic, which torch "
+            f"{torch.__version__} no longer provides; use OCR_BACKEND=torch or the torch version in requirements.txt"
+        )
+    for part in (predictor.det_predictor, predictor.reco_predictor):
+        part.model = torch.ao.quantization.quantize_dynamic(
+            part.model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8
+        )
+    return predictor
+
+def _load_int8_model(det_arch: str, reco_arch: str):
+    """
+    Loads the quantized predictor from OCR_MODEL_CACHE_DIR, or quantizes the
+    pretrained float32 models and writes the cache file on the first start.
+    """
+    path = os.path.join(OCR_MODEL_CACHE_DIR, f"{det_arch}-{reco_arch}-int8.pt")
+    if os.path.exists(path):
         try:
-            device = torch.device("cpu")
-            from doctr.models import ocr_predictor
-            # Lazy load model only when actual OCR is requested
-            model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True).to(device)
-            log_to_file("Model initialization successful!")
+            state = torch.load(path, map_location="cpu", weights_only=False)
+            # Packed int8 weights are tied to the torch build that produced them
+            if state.get("torch_version") == torch.__version__:
+                # Build the bare architecture; the cached state replaces every weight
+                predictor = _quantize_int8(ocr_predictor(
+                    det_arch=det_arch, reco_arch=reco_arch, pretrained=False,
+                    pretrained_backbone=False, det_bs=OCR_BATCH_MAX_SIZE
+                ))
+                predictor.det_predictor.model.load_state_dict(state["det"])
+                predictor.reco_predictor.model.load_state_dict(state["reco"])
+                log_to_file(f"Loaded quantized model from {path}")
+                return predictor
+            log_to_file(f"Quantized model {path} was built with torch {state.get('torch_version')}, rebuilding")
         except Exception as e:
-            msg = f"Failed to initialize Doctr model: {str(e)}"
-            log_to_file(msg)
-            raise
-    return model
+            log_to_file(f"Could not load quantized model {path}, rebuilding: {e}")
+
+    predictor = _quantize_int8(_pretrained_predictor(det_arch, reco_arch))
+    try:
+        os.makedirs(OCR_MODEL_CACHE_DIR, exist_ok=True)
+        # Write then rename, so workers starting together never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save({
+            "torch_version": torch.__version__,
+            "det": predictor.det_predictor.model.state_dict(),
+            "reco": predictor.reco_predictor.model.state_dict(),
+        }, tmp_path)
+        os.replace(tmp_path, path)
+        log_to_file(f"Saved quantized model to {path}")
+    except Exception as e:
+        # The quantized model is usable without the cache file
+        log_to_file(f"Could not save quantized model {path}: {e}")
+    return predictor
+
+def _build_model(profile: str):
+    det_arch, reco_arch = OCR_PROFILES[profile]
+    log_to_file(f"Starting model initialization ({profile}: {det_arch} + {reco_arch})...")
+    try:
+        start = time.perf_counter()
+        device = torch.device("cpu")
+        # Lazy load model only when actual OCR is requested
+        if OCR_BACKEND == "int8":
+            predictor = _load_int8_model(det_arch, reco_arch).to(device)
+        else:
+            predictor = _pretrained_predictor(det_arch, reco_arch).to(device)
+        log_to_file(f"Model initialization successful! ({time.perf_counter() - start:.1f}s, backend={OCR_BACKEND})")
+        return predictor
+    except Exception as e:
+        msg = f"Failed to initialize Doctr model: {str(e)}"
+        log_to_file(msg)
+        raise
+
+def _tensor_bytes(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    # Quantized layers keep their packed weights in (weight, bias) tuples
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+def _model_nbytes(predictor) -> int:
+    """
+    Memory held by a predictor's weights and buffers.
+    """
+    return sum(
+        _tensor_bytes(value)
+        for part in (predictor.det_predictor, predictor.reco_predictor)
+        for value in part.model.state_dict().values()
+    )
+
+# Loaded predictors, keyed by profile name
+model_registry = ModelRegistry(_build_model, _model_nbytes, OCR_MODEL_MEMORY_MB)
+# Seconds spent constructing each predictor (reported by the readiness probe)
+model_load_seconds = model_registry.load_seconds
+
+def get_model(profile: Optional[str] = None):
+    profile = profile or OCR_PROFILE
+    if profile not in OCR_PROFILES:
+        raise ValueError(f"Unknown OCR profile '{profile}'. Available: {', '.join(OCR_PROFILES)}")
+    if OCR_BACKEND not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{OCR_BACKEND}'. Available: {', '.join(OCR_BACKENDS)}")
+    return model_registry.get(profile)
+
+def warm_up(profile: Optional[str] = None) -> Dict:
+    """
+    Loads the model(s) and runs one inference on a blank page, so the first real
+    upload does not pay for weight loading or the slow first forward pass.
+    In cascade mode both tiers are warmed up.
+    """
+    profiles = [profile] if profile else active_profiles()
+
+    blank_page = np.full((1024, 768, 3), 255, dtype=np.uint8)
+    warmup_seconds = 0.0
+    for name in profiles:
+        model_instance = get_model(name)
+        start = time.perf_counter()
+        model_instance([blank_page])
+        warmup_seconds += time.perf_counter() - start
+    log_to_file(f"Model warm-up finished in {warmup_seconds:.1f}s")
+    return {
+        "pid": os.getpid(),
+        "profiles": profiles,
+        "load_seconds": round(sum(model_load_seconds.get(name, 0.0) for name in profiles), 3),
+        "warmup_seconds": round(warmup_seconds, 3),
+        "models": model_registry.stats()
+    }
 
 import logging
 logger = logging.getLogger(__name__)
 
-def log_error(message, error=None):
-    if error:
-        logger.exception(message)
-    else:
-        logger.error(message)
+def _as_gray(image):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def _thumbnail(gray, max_side):
+    """
+    Downsamples by the smallest integer factor that brings the longest side
+    to max_side or below (integer factors take OpenCV's fast INTER_AREA path).
+    """
+    (h, w) = gray.shape[:2]
+    factor = -(-max(h, w) // max_side)
+    if factor <= 1:
+        return gray
+    return cv2.resize(gray, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+
+def _min_area_rect_angle(thresh) -> Optional[float]:
+    """
+    Skew angle (degrees) of the foreground pixels in a binary image, or None
+    when there are too few of them.
+    """
+    # Find all non-zero pixels
+    coords = np.column_stack(np.where(thresh > 0))
+    if len(coords) < 10: # Not enough points to determine angle
+        return None
+
+    angle = cv2.minAreaRect(coords.astype(np.int32))[-1]
+
+    # cv2.minAreaRect returns angle in range [-90, 0)
+    if angle < -45:
+        return -(90 + angle)
+    return -angle
+
+def estimate_skew_angle_full(image) -> Optional[float]:
+    """
+    Reference estimator: Otsu threshold and minAreaRect over the full-resolution
+    image. Kept for benchmarking estimate_skew_angle.
+    """
+    gray = _as_gray(image)
+    gray = cv2.bitwise_not(gray)
+    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return _min_area_rect_angle(thresh)
+
+def estimate_skew_angle(image) -> Optional[float]:
+    """
+    Same estimate as estimate_skew_angle_full, computed on a copy downsampled
+    to OCR_DESKEW_MAX_SIDE. Rotation angles are scale invariant, and the point
+    set handed to minAreaRect shrinks by the square of the scale factor.
+    """
+    gray = _thumbnail(_as_gray(image), OCR_DESKEW_MAX_SIDE)
+    gray = cv2.bitwise_not(gray)
+    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return _min_area_rect_angle(thresh)
 
 def deskew(image):
     """
     Detects the skew angle of the text and rotates the image to straighten it.
     """
     try:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.bitwise_not(gray)
-        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-        
-        # Find all non-zero pixels
-        coords = np.column_stack(np.where(thresh > 0))
-        if len(coords) < 10: # Not enough points to determine angle
+        angle = estimate_skew_angle(image)
+        # A sub-0.1° rotation changes nothing for OCR but costs a full warp
+        if angle is None or abs(angle) < 0.1:
             return image
             
-        angle = cv2.minAreaRect(coords)[-1]
-        
-        # cv2.minAreaRect returns angle in range [-90, 0)
-        if angle < -45:
-            angle = -(90 + angle)
-        else:
-            angle = -angle
-            
         # Limit rotation to reasonable receipt angles (-30 to 30 degrees)
         if abs(angle) > 30:
             return image
@@ -83,42 +332,339 @@ def deskew(image):
         log_error("Deskew failed", e)
         return image
 
-def preprocess_image_for_ocr(image_content):
+def _paper_mask(gray):
     """
-    High-accuracy preprocessing for receipts.
+    Binary mask of bright paper regions in a (thumbnail) grayscale image:
+    Otsu threshold, then a closing so printed text does not punch holes
+    through the paper outline.
+    """
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+def _contour_quad(contour) -> np.ndarray:
+    """
+    Four corners of a paper contour, ordered top-left, top-right,
+    bottom-right, bottom-left.
+    """
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    if len(approx) == 4 and cv2.isContourConvex(approx):
+        pts = approx.reshape(4, 2).astype(np.float32)
+    else:
+        pts = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
+    sums = pts.sum(axis=1)
+    diffs = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(sums)], pts[np.argmin(diffs)],
+                     pts[np.argmax(sums)], pts[np.argmax(diffs)]], dtype=np.float32)
+
+def find_receipt_quad(image) -> Optional[np.ndarray]:
+    """
+    Finds the receipt outline in a photo. Returns its four corners in
+    full-resolution pixel coordinates, or None when no paper region covers
+    between OCR_CROP_MIN_AREA and OCR_CROP_MAX_AREA of the frame (already
+    cropped scans, receipts on a white table).
+    """
+    gray = _thumbnail(_as_gray(image), OCR_CROP_MAX_SIDE)
+    scale = image.shape[0] / gray.shape[0]
+    contours, _ = cv2.findContours(_paper_mask(gray), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    contour = max(contours, key=cv2.contourArea)
+    fraction = cv2.contourArea(contour) / float(gray.shape[0] * gray.shape[1])
+    if not OCR_CROP_MIN_AREA <= fraction <= OCR_CROP_MAX_AREA:
+        return None
+    return _contour_quad(contour) * scale
+
+def _looks_like_receipt(gray, contour) -> bool:
+    """
+    Text evidence for a paper region of the thumbnail: plausible shape and a
+    share of dark strokes (adaptive threshold) inside the contour.
+    """
+    (_, _), (w, h), _ = cv2.minAreaRect(contour)
+    if min(w, h) == 0 or max(w, h) / min(w, h) > OCR_MULTI_MAX_ASPECT:
+        return False
+    x, y, bw, bh = cv2.boundingRect(contour)
+    mask = np.zeros((bh, bw), np.uint8)
+    cv2.drawContours(mask, [contour - [x, y]], -1, 255, cv2.FILLED)
+    # Stay clear of the paper edge, which the threshold would count as ink
+    mask = cv2.erode(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9)))
+    area = cv2.countNonZero(mask)
+    if area == 0:
+        return False
+    ink = cv2.adaptiveThreshold(gray[y:y + bh, x:x + bw], 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY_INV, 15, 10)
+    fraction = cv2.countNonZero(cv2.bitwise_and(ink, mask)) / area
+    return OCR_MULTI_MIN_INK <= fraction <= OCR_MULTI_MAX_INK
+
+def split_receipt_regions(image_content) -> List[np.ndarray]:
+    """
+    Detects several receipts laid out in one photo. Returns one upright crop
+    per receipt (left to right, then top to bottom), or an empty list when the
+    photo holds fewer than two paper regions of at least OCR_MULTI_MIN_AREA
+    that carry print (see _looks_like_receipt).
+    Detection runs on a reduced grayscale decode; the full image is only
+    decoded when there is something to split.
+    """
+    small = decode_image(image_content, min_height=OCR_CROP_MAX_SIDE, grayscale=True)
+    if small is None:
+        return []
+    gray = _thumbnail(small, OCR_CROP_MAX_SIDE)
+    contours, _ = cv2.findContours(_paper_mask(gray), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = float(gray.shape[0] * gray.shape[1])
+    regions = [
+        c for c in contours
+        if cv2.contourArea(c) / frame_area >= OCR_MULTI_MIN_AREA and _looks_like_receipt(gray, c)
+    ]
+    if len(regions) < 2:
+        return []
+
+    row_height = gray.shape[0] / 3
+    regions.sort(key=lambda c: (int(cv2.boundingRect(c)[1] // row_height), cv2.boundingRect(c)[0]))
+    regions = regions[:OCR_MULTI_MAX_REGIONS]
+
+    image = decode_image(image_content)
+    scale = image.shape[0] / gray.shape[0]
+    return [warp_to_quad(image, _contour_quad(c) * scale) for c in regions]
+
+def warp_to_quad(image, quad):
+    """
+    Perspective-warps the quadrilateral (tl, tr, br, bl) to an upright rectangle.
+    """
+    (tl, tr, br, bl) = quad
+    width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    M = cv2.getPerspectiveTransform(quad, target)
+    return cv2.warpPerspective(image, M, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def _image_size_from_header(image_content) -> Optional[Tuple[int, int]]:
+    """
+    Reads the displayed image (width, height) from the file header without
+    decoding pixels (EXIF rotation swaps them, as cv2.imdecode does).
     """
     try:
-        nparr = np.frombuffer(image_content, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            log_error("Failed to decode image")
-            return None
+        with Image.open(io.BytesIO(image_content)) as img:
+            width, height = img.size
+            if img.format != "JPEG":
+                return None
+            if img.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+    except Exception:
+        return None
 
-        # Resize for consistency
-        height, width = image.shape[:2]
-        target_height = 1800
-        scale = target_height / height
-        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+_REDUCED_DECODE_FLAGS = {
+    False: ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)),
+    True: ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)),
+}
 
-        # Deskew
-        image = deskew(image)
+def decode_image(image_content, min_height: Optional[int] = None, grayscale: bool = False):
+    """
+    Decodes uploaded bytes to a BGR (or grayscale) image. Oversized JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale by libjpeg directly, as long as the
+    result stays at or above min_height (default OCR_MIN_HEIGHT). Long
+    receipts decoded for OCR keep at least the width resize_for_ocr tiles them at.
+    """
+    nparr = np.frombuffer(image_content, np.uint8)
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
 
-        # Grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    size = _image_size_from_header(image_content)
+    if size:
+        width, height = size
+        if min_height is None and OCR_TILE_ASPECT > 0 and height > OCR_TILE_ASPECT * width:
+            # Their height is never squashed, so the width is what must not shrink
+            min_width = min(OCR_TILE_WIDTH, width * _max_tiled_height() / height)
+            fits = lambda factor: width // factor >= min_width
+        else:
+            fits = lambda factor: height // factor >= (min_height or OCR_MIN_HEIGHT)
+        for factor, reduced_flag in _REDUCED_DECODE_FLAGS[grayscale]:
+            if fits(factor):
+                flags = reduced_flag
+                break
+
+    return cv2.imdecode(nparr, flags)
 
-        # CLAHE
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
+def is_long_receipt(image) -> bool:
+    height, width = image.shape[:2]
+    return OCR_TILE_ASPECT > 0 and height > OCR_TILE_ASPECT * width
 
-        # Denoising
-        denoised = cv2.bilateralFilter(enhanced, 7, 50, 50)
+def _max_tiled_height() -> int:
+    step = OCR_TILE_HEIGHT - OCR_TILE_OVERLAP
+    return OCR_TILE_MAX_TILES * step + OCR_TILE_OVERLAP
+
+def split_into_tiles(image) -> List[Tuple[np.ndarray, int, float, float]]:
+    """
+    Splits a long receipt into overlapping horizontal strips of OCR_TILE_HEIGHT.
+    Returns (strip, y offset, own_start, own_end) per strip: a line belongs to
+    the strip whose own band [own_start, own_end) holds its vertical centre,
+    so lines in an overlap are kept exactly once.
+    """
+    height = image.shape[0]
+    step = OCR_TILE_HEIGHT - OCR_TILE_OVERLAP
+    offsets = list(range(0, max(1, height - OCR_TILE_OVERLAP), step))
+    tiles = []
+    for i, y0 in enumerate(offsets):
+        y1 = min(height, y0 + OCR_TILE_HEIGHT)
+        own_start = 0 if i == 0 else y0 + OCR_TILE_OVERLAP / 2
+        own_end = height if i == len(offsets) - 1 else y1 - OCR_TILE_OVERLAP / 2
+        tiles.append((image[y0:y1], y0, own_start, own_end))
+    return tiles
 
-        # Sharpening
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        sharpened = cv2.filter2D(denoised, -1, kernel)
+def resize_for_ocr(image):
+    """
+    Brings the image into the [OCR_MIN_HEIGHT, OCR_MAX_HEIGHT] band and under
+    OCR_MAX_PIXELS. Images already in range are left alone; downscaling uses
+    area interpolation, upscaling cubic.
+    """
+    height, width = image.shape[:2]
 
-        return sharpened
+    if is_long_receipt(image):
+        # OCR'd in strips later, so normalise the width instead of squashing
+        # the height (which would make the print unreadable)
+        scale = min(OCR_TILE_WIDTH / width, _max_tiled_height() / height)
+        if abs(scale - 1.0) < 0.01:
+            return image
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+    scale = 1.0
+    if height > OCR_MAX_HEIGHT:
+        scale = OCR_TARGET_HEIGHT / height
+    elif height < OCR_MIN_HEIGHT:
+        scale = OCR_MIN_HEIGHT / height
+
+    # Cap the total pixel count (very wide photos)
+    if height * width * scale * scale > OCR_MAX_PIXELS:
+        scale = (OCR_MAX_PIXELS / (height * width)) ** 0.5
+
+    if abs(scale - 1.0) < 0.01:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+# Second-difference kernel for the noise estimate (Immerkaer, 1996)
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+def probe_image_quality(image) -> Dict:
+    """
+    Cheap quality measurements on a thumbnail: contrast (5th-95th percentile
+    spread), noise (estimated sigma) and sharpness (Laplacian variance).
+    """
+    gray = _thumbnail(_as_gray(image), OCR_PROBE_MAX_SIDE)
+    (h, w) = gray.shape[:2]
+    p5, p95 = np.percentile(gray, (5, 95))
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    residual = cv2.filter2D(gray.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]
+    noise = np.sqrt(np.pi / 2) * np.abs(residual).sum() / (6 * max(1, (w - 2) * (h - 2)))
+    return {
+        "contrast": round(float(p95 - p5), 1),
+        "noise": round(float(noise), 2),
+        "sharpness": round(float(sharpness), 1)
+    }
+
+# Preprocessing stages. Each takes the current image plus a per-request context
+# dict (for state one stage leaves for a later one) and returns the new image.
+
+def _stage_probe(image, context):
+    # Decide which enhancement stages this image actually needs
+    quality = probe_image_quality(image)
+    skipped = []
+    if quality["contrast"] >= OCR_PROBE_CONTRAST_MIN:
+        skipped.append("clahe")
+    if quality["noise"] <= OCR_PROBE_NOISE_MAX:
+        skipped.append("denoise")
+    if quality["sharpness"] >= OCR_PROBE_SHARPNESS_MIN:
+        skipped.append("sharpen")
+    context["quality"] = quality
+    context["skipped_stages"] = skipped
+    return image
+
+def _stage_crop(image, context):
+    quad = find_receipt_quad(image)
+    if quad is None:
+        return image
+    context["cropped"] = True
+    return warp_to_quad(image, quad)
+
+def _stage_resize(image, context):
+    return resize_for_ocr(image)
+
+def _stage_deskew(image, context):
+    return deskew(image)
+
+def _stage_grayscale(image, context):
+    return _as_gray(image)
+
+def _stage_clahe(image, context):
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe.apply(_as_gray(image))
+
+def _stage_denoise(image, context):
+    return cv2.bilateralFilter(image, 7, 50, 50)
+
+def _stage_sharpen(image, context):
+    kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+    return cv2.filter2D(image, -1, kernel)
+
+PREPROCESS_STAGES = {
+    "probe": _stage_probe,
+    "crop": _stage_crop,
+    "resize": _stage_resize,
+    "deskew": _stage_deskew,
+    "grayscale": _stage_grayscale,
+    "clahe": _stage_clahe,
+    "denoise": _stage_denoise,
+    "sharpen": _stage_sharpen,
+}
+
+def _load_preprocess_pipeline() -> List[str]:
+    names = [n.strip() for n in OCR_PREPROCESS_PIPELINE.split(",") if n.strip()]
+    unknown = [n for n in names if n not in PREPROCESS_STAGES]
+    if unknown:
+        logger.warning(f"Ignoring unknown preprocessing stage(s): {', '.join(unknown)}. "
+                       f"Available: {', '.join(PREPROCESS_STAGES)}")
+    return [n for n in names if n in PREPROCESS_STAGES]
+
+preprocess_pipeline = _load_preprocess_pipeline()
+
+def preprocess_image_for_ocr(image_content, timings: Optional[Dict] = None, context: Optional[Dict] = None):
+    """
+    High-accuracy preprocessing for receipts.
+    Runs the stages listed in OCR_PREPROCESS_PIPELINE in order. When a timings
+    dict is passed, the wall time of decoding and of each stage is recorded in
+    it (milliseconds). The context dict is shared by the stages; the probe
+    stage leaves its measurements and skipped stages there. If the context
+    holds an "is_cancelled" callable, it is checked before every stage and
+    OCRCancelled raised once it returns True.
+    """
+    if timings is None:
+        timings = {}
+    if context is None:
+        context = {}
+    try:
+        start = time.perf_counter()
+        # Crops from split_receipt_regions arrive already decoded
+        image = image_content if isinstance(image_content, np.ndarray) else decode_image(image_content)
+        timings["decode"] = round((time.perf_counter() - start) * 1000, 1)
+        
+        if image is None:
+            log_error("Failed to decode image")
+            return None
+
+        for name in preprocess_pipeline:
+            if name in context.get("skipped_stages", ()):
+                continue
+            if context.get("is_cancelled") and context["is_cancelled"]():
+                raise OCRCancelled()
+            start = time.perf_counter()
+            image = PREPROCESS_STAGES[name](image, context)
+            timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+        return image
+    except OCRCancelled:
+        raise
     except Exception as e:
         log_error("Preprocessing failed", e)
         return None
@@ -389,8 +935,294 @@ class ReceiptAnalyzer:
         return fr'({"|".join(map(re.escape, self.supported_currencies))})?\s*(\d+(?:[.,]\d+)?(?:/-)?)'
 
 
-# Initialize global analyzer
-analyzer = ReceiptAnalyzer()
+# Date patterns tried by _extract_date_from_text, in order
+_DATE_PATTERNS = [
+    re.compile(r'\d{4}[-/年]\d{1,2}[-/月]\d{1,2}'),
+    re.compile(r'\d{1,2}[-/]\d{1,2}[-/]\d{4}'),
+    re.compile(r'\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'),
+    re.compile(r'\d{4}/\d{1,2}/\d{1,2}'),
+]
+_DATE_OCR_FIXES = str.maketrans({'O': '0', 'o': '0', 'l': '1', 'I': '1', 'S': '5'})
+# Same substitutions as ReceiptAnalyzer._clean_numeric_value, in one table
+_NUMERIC_OCR_FIXES = str.maketrans({
+    'O': '0', 'D': '0', 'Q': '0', 'G': '9', 'S': '5', 'Z': '2', 'T': '7', 'B': '8',
+    'I': '1', 'L': '1', '|': '1'
+})
+_DATE_KEYWORDS = ['date:', 'dated:', 'bill date:', 'invoice date:', 'printed on:']
+_TOTAL_INDICATORS = ['total', 'amount', 'sum', 'due', 'pay', 'balance', 'grand total', 'net']
+_ITEM_NOISE_WORDS = ['total', 'subtotal', 'tax', 'date', 'amount', 'due', 'thank', 'visit', 'hscode', 'gst', 'vat', 'net', 'change', 'cash', 'card']
+_ITEM_DATE_LINE = re.compile(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}')
+_ITEM_LEADING_NUMBER = re.compile(r'^[\d]+\s*[).]*\s*')
+_ITEM_LEADING_SYMBOLS = re.compile(r'^[^\w\s]+')
+_ISSUED_BY = re.compile(r'issued\s*by\s*:?\s*', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+class CompiledReceiptAnalyzer(ReceiptAnalyzer):
+    """
+    ReceiptAnalyzer with every pattern compiled once and a single pass over the
+    lines that collects what the individual extractors need. analyze_text
+    returns exactly what ReceiptAnalyzer.analyze_text returns.
+    """
+    def __init__(self):
+        super().__init__()
+        currencies = "|".join(map(re.escape, self.supported_currencies))
+        self.amount_regex = re.compile(self._get_amount_pattern())
+        self.item_regex = re.compile(fr'(.*?)\s*({currencies})?\s*(\d+[.,]\d{{2}})$')
+        self.currency_regexes = [
+            (cur, re.compile('|'.join(pats), re.IGNORECASE)) for cur, pats in self.currency_patterns.items()
+        ]
+        # Lines without any currency token skip the per-currency searches
+        self.any_currency_regex = re.compile(
+            '|'.join(p for pats in self.currency_patterns.values() for p in pats), re.IGNORECASE
+        )
+
+    def analyze_text(self, text_blocks: List[str]) -> Dict:
+        currency_counts = dict.fromkeys(self.currency_patterns, 0)
+        date_lines = []          # (has date keyword, text) per line
+        amount_matches = []      # (currency, value) matches per line
+        total_lines = []         # indexes of lines with a total indicator
+        items = []
+        # Amounts are only read from total lines and the bottom half
+        bottom_half = int(len(text_blocks)*0.5)
+
+        for index, text in enumerate(text_blocks):
+            lower = text.lower()
+            if self.any_currency_regex.search(text):
+                for cur, regex in self.currency_regexes:
+                    if regex.search(text):
+                        currency_counts[cur] += 1
+            date_lines.append((any(k in lower for k in _DATE_KEYWORDS), text))
+            is_total = any(i in lower for i in _TOTAL_INDICATORS)
+            if is_total:
+                total_lines.append(index)
+            amount_matches.append([
+                (match.group(1), self._clean_numeric_value(match.group(2)))
+                for match in self.amount_regex.finditer(text)
+            ] if is_total or index >= bottom_half else [])
+            if item := self._match_item(text, lower):
+                items.append(item)
+
+        counts = {cur: n for cur, n in currency_counts.items() if n}
+        currency = max(counts.items(), key=lambda x: x[1])[0] if counts else 'NPR'
+        bill_date = self._date_from_lines(date_lines)
+        merchant_name, _ = self._find_merchant(text_blocks)
+        # The currency next to the chosen total overrides the detected one
+        amount, currency = self._pick_amount(text_blocks, amount_matches, total_lines, currency)
+
+        extracted_data = {
+            'merchant_name': merchant_name, 'bill_date': bill_date,
+            'amount': amount, 'currency': currency,
+        }
+        confidence = self._calculate_confidence(extracted_data)
+
+        # Validate and cap the total amount to prevent OCR errors
+        MAX_REASONABLE_AMOUNT = 100000  # $100,000 max for receipts
+        total_amount = float(amount) if amount else None
+
+        if total_amount and total_amount > MAX_REASONABLE_AMOUNT:
+            log_to_file(f"WARNING: Extracted amount ${total_amount:,.2f} exceeds maximum. Capping at ${MAX_REASONABLE_AMOUNT:,.2f}")
+            total_amount = None  # Set to None if unrealistic, will be handled by receipt upload logic
+
+        return {
+            "merchant_name": merchant_name or "Unknown",
+            "date_extracted": bill_date,
+            "total_amount": total_amount,
+            "currency": currency,
+            "items": items,
+            "confidence": confidence,
+            "raw_text": "\n".join(text_blocks)
+        }
+
+    def _date_from_lines(self, date_lines: List[Tuple[bool, str]]) -> Optional[datetime]:
+        # A dated keyword line wins; otherwise the first line with any date
+        first_date = None
+        for has_keyword, text in date_lines:
+            if not has_keyword and first_date is not None:
+                continue
+            match = self._extract_date_from_text(text)
+            if match and has_keyword:
+                return match
+            if match and first_date is None:
+                first_date = match
+        return first_date
+
+    def _extract_date_from_text(self, text: str) -> Optional[datetime]:
+        text = text.translate(_DATE_OCR_FIXES)
+        for pattern in _DATE_PATTERNS:
+            if match := pattern.search(text):
+                try: return self._normalize_date(match.group(0))
+                except: continue
+        return None
+
+    def _pick_amount(self, text_blocks, amount_matches, total_lines, detected_currency):
+        all_candidates = []
+
+        # Strategy 1: numbers on "Total" lines, bottom line first
+        for index in reversed(total_lines):
+            for cur, val in amount_matches[index]:
+                if val > 0: all_candidates.append((val, cur or detected_currency, 1.0))
+
+        # Strategy 2: any number in the bottom half (handwritten receipts)
+        if not all_candidates:
+            for matches in amount_matches[int(len(text_blocks)*0.5):]:
+                for cur, val in matches:
+                    if val > 0 and val < 100000:
+                        confidence = 0.8 if cur else 0.6
+                        all_candidates.append((val, cur or detected_currency, confidence))
+
+        # Strategy 3: same candidate ordering as ReceiptAnalyzer._extract_amounts
+        if all_candidates:
+            all_candidates.sort(key=lambda x: (x[2], x[0]), reverse=True)
+            if all_candidates[0][2] < 0.9:
+                all_candidates.sort(key=lambda x: x[0], reverse=True)
+            return str(all_candidates[0][0]), all_candidates[0][1]
+        return None, detected_currency
+
+    def _match_item(self, text: str, lower: str) -> Optional[Dict]:
+        if any(k in lower for k in _ITEM_NOISE_WORDS): return None
+        if _ITEM_DATE_LINE.search(text): return None
+        match = self.item_regex.search(text)
+        if not match: return None
+
+        val = self._clean_numeric_value(match.group(3))
+        desc = match.group(1).strip()
+        desc = _ITEM_LEADING_NUMBER.sub('', desc)
+        desc = _ITEM_LEADING_SYMBOLS.sub('', desc).strip()
+
+        MAX_ITEM_PRICE = 10000
+        if val > 0 and val <= MAX_ITEM_PRICE and len(desc) > 2:
+            return {'item_name': desc, 'price': float(val)}
+        return None
+
+    def _find_merchant(self, text_blocks: List[str]) -> Tuple[Optional[str], float]:
+        merchant_indicators = ['ltd', 'limited', 'inc', 'corp', 'co', 'company', 'store', 'restaurant', 'shop', 'cafe', 'hotel', 'mall', 'market', 'pvt', 'kitchen', 'pasal']
+
+        for text in text_blocks:
+            if "ISSUED BY" in text.upper():
+                parts = _ISSUED_BY.split(text)
+                if len(parts) > 1 and len(parts[1].strip()) > 2:
+                    return self._correct_merchant_name(parts[1].strip()), 1.0
+
+        for text in text_blocks[:5]:
+            cleaned = self._preprocess_text(text)
+            if len(text.strip()) < 3 or self._is_unwanted_merchant_line(cleaned): continue
+
+            if any(i in cleaned for i in merchant_indicators):
+                return self._correct_merchant_name(text.strip()), 0.95
+
+            if text.isupper() and len(text.split()) > 1:
+                return self._correct_merchant_name(text.strip()), 0.85
+
+        for text in text_blocks[:3]:
+            if len(text.strip()) > 3 and not any(c.isdigit() for c in text):
+                return self._correct_merchant_name(text.strip()), 0.7
+
+        return None, 0.0
+
+    def _clean_numeric_value(self, s: str) -> float:
+        s = s.upper().translate(_NUMERIC_OCR_FIXES)
+        s = s.replace('/-', '').replace('/=', '')
+        s = s.replace(',', '.')
+        digits_only = "".join([c for c in s if c.isdigit() or c == '.'])
+
+        if not digits_only:
+            return 0.0
+
+        try:
+            if digits_only.count('.') > 1:
+                parts = digits_only.split('.')
+                digits_only = "".join(parts[:-1]) + "." + parts[-1]
+            return float(digits_only)
+        except:
+            return 0.0
+
+    def _preprocess_text(self, text: str) -> str:
+        return _PUNCTUATION.sub('', _WHITESPACE.sub(' ', text.lower().strip()))
+
+
+# Initialize global analyzer ("legacy" keeps the original multi-pass ReceiptAnalyzer)
+OCR_ANALYZER = os.getenv("OCR_ANALYZER", "compiled")
+analyzer = ReceiptAnalyzer() if OCR_ANALYZER == "legacy" else CompiledReceiptAnalyzer()
+
+def _extract_text_blocks_from_page(page) -> List[str]:
+    """
+    Extracts text lines from a single Doctr page: block → line → word
+    """
+    text_blocks = []
+    for block in page.blocks:
+        for line in block.lines:
+            text = ' '.join(word.value for word in line.words)
+            if text.strip():
+                text_blocks.append(text.strip())
+    return text_blocks
+
+def _extract_lines_with_position(page) -> List[Tuple[str, float, float]]:
+    """
+    Text lines of a Doctr page with the vertical centre and the height of
+    each line, in pixels of that page.
+    """
+    page_height = page.dimensions[0]
+    lines = []
+    for block in page.blocks:
+        for line in block.lines:
+            text = ' '.join(word.value for word in line.words).strip()
+            if text:
+                ys = [point[1] for point in line.geometry]
+                lines.append((text, float(np.mean(ys)) * page_height, float(max(ys) - min(ys)) * page_height))
+    return lines
+
+def _stitch_tiles(tile_pages) -> List[str]:
+    """
+    Joins the text lines of the strips of one long receipt, in strip order.
+    Each strip keeps only the lines centred in its own band. A line read by
+    both strips whose centre lands on either side of the band boundary is
+    dropped the second time, but only when both copies are the same printed
+    line (centres within half a line height): identical rows next to each
+    other are genuinely repeated items.
+    """
+    text_blocks = []
+    last = None
+    for page, (y0, own_start, own_end) in tile_pages:
+        kept = [(text, y0 + y_center, height) for text, y_center, height in _extract_lines_with_position(page)
+                if own_start <= y0 + y_center < own_end]
+        if last and kept and kept[0][0] == last[0]:
+            line_height = max(last[2], kept[0][2])
+            if abs(kept[0][1] - last[1]) < line_height / 2:
+                kept = kept[1:]
+        text_blocks.extend(text for text, _, _ in kept)
+        if kept:
+            last = kept[-1]
+    return text_blocks
+
+def _read_text_blocks(pages: List[np.ndarray], model_instance) -> List[List[str]]:
+    """
+    One Doctr forward pass over all pages; long receipts go in as overlapping
+    strips in the same batch. Returns the text lines of each page.
+    """
+    inputs, owners = [], []
+    for idx, page in enumerate(pages):
+        if is_long_receipt(page):
+            for strip, y0, own_start, own_end in split_into_tiles(page):
+                inputs.append(strip)
+                owners.append((idx, (y0, own_start, own_end)))
+        else:
+            inputs.append(page)
+            owners.append((idx, None))
+
+    result = model_instance(inputs)
+
+    text_blocks: List[List[str]] = [[] for _ in pages]
+    tiles: Dict[int, list] = {}
+    for (idx, tile), doc_page in zip(owners, result.pages):
+        if tile is None:
+            text_blocks[idx] = _extract_text_blocks_from_page(doc_page)
+        else:
+            tiles.setdefault(idx, []).append((doc_page, tile))
+    for idx, tile_pages in tiles.items():
+        text_blocks[idx] = _stitch_tiles(tile_pages)
+    return text_blocks
 
 def _extract_text_blocks_from_doctr(result) -> List[str]:
     """
@@ -399,51 +1231,155 @@ def _extract_text_blocks_from_doctr(result) -> List[str]:
     """
     text_blocks = []
     for page in result.pages:
-        for block in page.blocks:
-            for line in block.lines:
-                text = ' '.join(word.value for word in line.words)
-                if text.strip():
-                    text_blocks.append(text.strip())
+        text_blocks.extend(_extract_text_blocks_from_page(page))
     return text_blocks
 
-def extract_text(image_content):
+def _to_doctr_page(image: np.ndarray) -> np.ndarray:
     """
-    Main OCR extraction using Doctr (from GitHub repo).
+    Converts a preprocessed OpenCV image into a Doctr page (RGB uint8, HxWx3),
+    the same layout DocumentFile.from_images would produce after decoding.
+    """
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def _ocr_pages(pages: List[np.ndarray], profile: Optional[str]) -> List[Dict]:
+    """
+    Runs one Doctr forward pass over the pages and analyzes each page's text.
+    """
+    profile = profile or OCR_PROFILE
+    model_instance = get_model(profile)
+    start = time.perf_counter()
+    page_text_blocks = _read_text_blocks(pages, model_instance)
+    # One forward pass serves the whole batch; every page reports its wall time
+    ocr_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    parsed = []
+    for text_blocks in page_text_blocks:
+        print("----- DOCTR OCR OUTPUT -----")
+        for l in text_blocks: print(l)
+        print("----------------------------")
+
+        start = time.perf_counter()
+        data = analyzer.analyze_text(text_blocks)
+        data["ocr_tier"] = profile
+        data["ocr_passes"] = 1
+        data["timings"] = {
+            f"ocr_{profile}": ocr_ms,
+            "analyze": round((time.perf_counter() - start) * 1000, 1)
+        }
+        parsed.append(data)
+    return parsed
+
+def _needs_heavy_pass(parsed: Dict) -> bool:
+    if not parsed or "confidence" not in parsed:
+        return True
+    missing_field = (
+        parsed.get("merchant_name") in (None, "Unknown")
+        or parsed.get("total_amount") is None
+        or parsed.get("date_extracted") is None
+    )
+    return missing_field or parsed["confidence"] < OCR_CASCADE_MIN_CONFIDENCE
+
+def _ocr_pages_cascade(pages: List[np.ndarray], is_cancelled: Optional[Callable[[int], bool]] = None) -> List[Dict]:
+    """
+    Fast profile first; pages it could not read well go through the heavy profile
+    (unless is_cancelled(page index) says nobody wants the result any more).
     """
     try:
-        # 1. Preprocess and save to temp file (Doctr requires file path)
-        processed_image = preprocess_image_for_ocr(image_content)
-        if processed_image is None: 
-            return {}
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-            cv2.imwrite(tmp.name, processed_image)
-            tmp_path = tmp.name
-        
+        parsed = _ocr_pages(pages, OCR_CASCADE_FAST_PROFILE)
+    except Exception as e:
+        log_error("Fast OCR tier failed, falling back to heavy tier", e)
+        parsed = [{} for _ in pages]
+
+    retry = [
+        i for i, data in enumerate(parsed)
+        if _needs_heavy_pass(data) and not (is_cancelled and is_cancelled(i))
+    ]
+    if retry:
+        heavy = _ocr_pages([pages[i] for i in retry], OCR_CASCADE_HEAVY_PROFILE)
+        for i, data in zip(retry, heavy):
+            data["ocr_passes"] = 2
+            # The fast pass was paid for too
+            data["timings"] = {**parsed[i].get("timings", {}), **data["timings"]}
+            parsed[i] = data
+    log_to_file(f"OCR cascade: {len(pages) - len(retry)}/{len(pages)} served by {OCR_CASCADE_FAST_PROFILE}")
+    return parsed
+
+def extract_text_batch(
+    image_contents: List[Union[bytes, np.ndarray]],
+    profile: Optional[str] = None,
+    tickets: Optional[List[int]] = None
+) -> List[Dict]:
+    """
+    Runs OCR on several receipts with a single Doctr forward pass.
+    Each input is either uploaded file bytes or an already decoded BGR image.
+    Returns one result per input, in order, with the same shape as extract_text.
+    profile selects the detector/recognizer pair (see OCR_PROFILES); without
+    one, OCR_CASCADE decides between the cascade and OCR_PROFILE.
+    tickets (one per input) let the API abandon inputs mid-batch: work on an
+    input stops at the next stage boundary once its ticket is cancelled, and
+    its result is {"cancelled": True}.
+    """
+    results: List[Dict] = [{} for _ in image_contents]
+
+    def is_cancelled(idx: int) -> bool:
+        if tickets is None or _cancel_check is None or not _cancel_check(tickets[idx]):
+            return False
+        results[idx] = {"cancelled": True}
+        return True
+
+    # 1. Preprocess in memory; the arrays go straight to the predictor
+    pages = []
+    for idx, image_content in enumerate(image_contents):
+        timings, context = {}, {"is_cancelled": lambda idx=idx: is_cancelled(idx)}
         try:
-            # 2. Run Doctr OCR
-            model_instance = get_model()
-            doc = DocumentFile.from_images(tmp_path)
-            result = model_instance(doc)
-            
-            # 3. Extract text blocks
-            text_blocks = _extract_text_blocks_from_doctr(result)
-            
-            print("----- DOCTR OCR OUTPUT -----")
-            for l in text_blocks: print(l)
-            print("----------------------------")
-            
-            # 4. Analyze with ReceiptAnalyzer
-            return analyzer.analyze_text(text_blocks)
+            processed_image = preprocess_image_for_ocr(image_content, timings, context)
+        except OCRCancelled:
+            continue
         except Exception as e:
-            log_error("Doctr OCR Model failure", e)
-            return {"raw_text": "Error during OCR processing. Check logs."}
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+            log_error("Top-level OCR FAILED", e)
+            continue
+        if processed_image is None:
+            continue
+        pages.append((idx, _to_doctr_page(processed_image), timings, context))
+
+    pages = [page for page in pages if not is_cancelled(page[0])]
+    if not pages:
+        return results
 
+    try:
+        # 2. Run Doctr OCR on all pages at once, then ReceiptAnalyzer per page
+        images = [page for _, page, _, _ in pages]
+        if OCR_CASCADE and profile is None:
+            parsed = _ocr_pages_cascade(images, lambda i: is_cancelled(pages[i][0]))
+        else:
+            parsed = _ocr_pages(images, profile)
+
+        for (idx, _, timings, context), data in zip(pages, parsed):
+            if results[idx].get("cancelled"):
+                continue
+            # Per-stage wall times (ms): preprocessing stages, model pass(es), analysis
+            data["timings"] = {**timings, **data.get("timings", {})}
+            if "quality" in context:
+                data["preprocessing"] = {
+                    "quality": context["quality"],
+                    "skipped_stages": context["skipped_stages"]
+                }
+            results[idx] = data
+    except Exception as e:
+        log_error("Doctr OCR Model failure", e)
+        for idx, _, _, _ in pages:
+            results[idx] = {"raw_text": "Error during OCR processing. Check logs."}
+
+    return results
+
+def extract_text(image_content, profile: Optional[str] = None, ticket: Optional[int] = None):
+    """
+    Main OCR extraction using Doctr (from GitHub repo).
+    """
+    try:
+        return extract_text_batch([image_content], profile, None if ticket is None else [ticket])[0]
     except Exception as e:
         log_error("Top-level OCR FAILED", e)
         return {}
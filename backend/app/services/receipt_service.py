@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+
+from app.database import get_database
+from app.services.game_service import update_monthly_streak
+from app.services.job_queue import (
+    JOB_MAX_QUEUED, JOB_QUEUE_RETRY_AFTER_SECONDS, count_queued, enqueue, request_cancel
+)
+from app.services.ocr_admission import LANES, AdmissionQueueFull, get_admission
+from app.services.ocr_cache import get_cached_results, store_results
+from app.services.ocr_executor import run_ocr, split_regions
+from app.utils.ocr_log import log_to_file
+
+logger = logging.getLogger(__name__)
+
+
+async def ensure_receipt_indexes():
+    db = get_database()
+    try:
+        # Every upload job looks up receipts left by an interrupted run
+        await db.receipts.create_index("job_id", sparse=True)
+    except Exception as e:
+        logger.error(f"Failed to create receipt indexes: {e}")
+
+
+def categorize_merchant(merchant: str) -> str:
+    # Simple Keyword Categorization
+    m_lower = (merchant or "Unknown").lower()
+    if any(k in m_lower for k in ['food', 'kitchen', 'restaurant', 'cafe', 'bhat', 'pizza']): return "Food"
+    if any(k in m_lower for k in ['mart', 'store', 'market', 'grocery', 'kirana']): return "Groceries"
+    if any(k in m_lower for k in ['fuel', 'petrol', 'taxi', 'ride']): return "Transport"
+    return "Shopping"
+
+
+async def save_receipt(
+    user_id: str,
+    parsed_data: Dict,
+    image_url: str,
+    file_hash: str,
+    manual_date: Optional[str] = None,
+    manual_category: Optional[str] = None,
+    region: Optional[int] = None,
+    job_id: Optional[str] = None
+) -> str:
+    """
+    Stores one parsed receipt and its expenses. parsed_data is updated with the
+    final date so the caller can return it. Returns the new receipt id.
+    region is the receipt's position when one photo held several receipts;
+    job_id the upload job that created it, if any.
+    """
+    db = get_database()
+
+    # Categorize Merchant
+    detected_category = categorize_merchant(parsed_data.get("merchant_name", "Unknown"))
+
+    # Enrich items with categories (Prioritize Manual Category if set)
+    enriched_items = []
+    for item in parsed_data.get("items", []):
+        category = manual_category if manual_category else detected_category
+        enriched_items.append({
+            "description": item["item_name"], # Note: ReceiptAnalyzer uses 'item_name'
+            "amount": item["price"],          # Note: ReceiptAnalyzer uses 'price'
+            "quantity": 1.0,
+            "category": category
+        })
+
+    # Determine date - Prioritize OCR extraction, fallback to manual, then upload date
+    final_date = parsed_data.get("date_extracted")
+
+    # If manual date provided and OCR failed, use manual
+    if not final_date and manual_date:
+        try:
+            final_date = datetime.fromisoformat(manual_date.replace('Z', '+00:00'))
+        except:
+            pass
+
+    # Final fallback: use upload date
+    if not final_date:
+        final_date = datetime.utcnow()
+
+    # Create Receipt Object
+    receipt_data = {
+        "user_id": user_id,
+        "image_url": image_url, # In prod, return a static URL
+        "uploaded_at": datetime.utcnow(),
+        "merchant_name": parsed_data.get("merchant_name", "Unknown"),
+        "total_amount": parsed_data.get("total_amount") or 0.0,
+        "date_extracted": final_date,
+        "raw_text": parsed_data.get("raw_text", ""),
+        "items": enriched_items,
+        "content_hash": file_hash,
+        "region": region,
+        "job_id": job_id,
+        "ocr_tier": parsed_data.get("ocr_tier"),
+        "ocr_passes": parsed_data.get("ocr_passes"),
+        # Quality probe measurements and skipped enhancement stages, if enabled
+        "preprocessing": parsed_data.get("preprocessing")
+    }
+
+    new_receipt = await db.receipts.insert_one(receipt_data)
+    receipt_id = str(new_receipt.inserted_id)
+
+    # Insert individual items as Expenses for Analytics
+    expense_docs = []
+    for item in enriched_items:
+        expense_docs.append({
+            "user_id": user_id,
+            "description": item["description"],
+            "amount": item["amount"],
+            "category": item["category"],
+            "date": final_date,
+            "receipt_id": receipt_id,
+            "created_at": datetime.utcnow()
+        })
+
+    if expense_docs:
+        await db.expenses.insert_many(expense_docs)
+    elif receipt_data["total_amount"] > 0:
+        # Fallback: If no items parsed but we have a total, create a single expense
+        merchant_name = parsed_data.get("merchant_name", "Receipt Total")
+
+        await db.expenses.insert_one({
+            "user_id": user_id,
+            "description": merchant_name,
+            "amount": receipt_data["total_amount"],
+            "category": manual_category or detected_category,
+            "date": final_date,
+            "receipt_id": receipt_id,
+            "created_at": datetime.utcnow()
+        })
+
+    # Update parsed_data with the final decided values so frontend sees them
+    parsed_data["date_extracted"] = final_date
+
+    return receipt_id
+
+
+def upload_response(message: str, receipts: List[Dict], **extra) -> Dict:
+    # The first receipt stays at the top level so single-receipt clients keep working
+    response = {
+        "message": message,
+        "receipt_id": receipts[0]["receipt_id"],
+        "parsed_data": receipts[0]["parsed_data"],
+        **extra
+    }
+    if len(receipts) > 1:
+        response["receipts"] = receipts
+    return response
+
+
+async def process_upload(
+    user_id: str,
+    file_bytes: bytes,
+    file_hash: str,
+    filepath: str,
+    manual_date: Optional[str] = None,
+    manual_category: Optional[str] = None,
+    progress: Optional[Callable] = None,
+    job_id: Optional[str] = None,
+    lane: str = "interactive",
+    block: bool = False
+) -> Dict:
+    """
+    OCRs a saved upload and stores one receipt per receipt found in it.
+    Returns the upload response plus per-stage timings (None on a cache hit).
+    progress, if given, is awaited with the name of each stage as it starts
+    and whether the upload may still be cancelled there: OCR stages can be
+    abandoned (the OCR workers stop at their next stage boundary), saving
+    the receipts cannot. OCR waits for an admission slot in lane; AdmissionQueueFull is raised
+    when that lane is full, unless block is set.
+    """
+    filename = os.path.basename(filepath)
+
+    async def report(stage: str, cancellable: bool = True):
+        if progress:
+            await progress(stage, cancellable)
+
+    # Identical bytes always parse the same way, so reuse the previous result
+    timings = None
+    results = await get_cached_results(file_hash)
+    if results is not None:
+        log_to_file(f"OCR cache hit for file: {filename}")
+        # No model pass was spent on this upload
+        for parsed_data in results:
+            parsed_data["ocr_passes"] = 0
+    else:
+        await report("waiting")
+        async with get_admission().slot(lane, block=block):
+            log_to_file(f"Starting OCR for file: {filename}")
+            await report("ocr")
+
+            # Several receipts in one photo are cropped apart and OCR'd concurrently;
+            # the batcher groups the crops into one forward pass
+            regions = await split_regions(file_bytes)
+            if regions:
+                log_to_file(f"Found {len(regions)} receipts in file: {filename}")
+                results = list(await asyncio.gather(*[run_ocr(region) for region in regions]))
+                # A region with neither an amount nor items was not a receipt
+                # (napkin, glare); keep the first one if none of them read
+                readable = [r for r in results if r.get("total_amount") is not None or r.get("items")]
+                if len(readable) < len(results):
+                    log_to_file(f"Dropped {len(results) - len(readable)} unreadable region(s) in file: {filename}")
+                    results = readable or results[:1]
+            else:
+                # extract_text returns a structured dict result directly (ReceiptAnalyzer integration)
+                # It runs in the OCR process pool so other requests are not blocked
+                results = [await run_ocr(file_bytes)]
+        timings = [parsed_data.pop("timings", None) for parsed_data in results]
+        await store_results(file_hash, results)
+
+    await report("saving", cancellable=False)
+    receipts = []
+    for index, parsed_data in enumerate(results):
+        log_to_file(f"OCR completed. Merchant: {parsed_data.get('merchant_name')}")
+        receipt_id = await save_receipt(
+            user_id,
+            parsed_data,
+            filepath,
+            file_hash,
+            manual_date=manual_date,
+            manual_category=manual_category,
+            region=index if len(results) > 1 else None,
+            job_id=job_id
+        )
+        receipts.append({"receipt_id": receipt_id, "parsed_data": parsed_data})
+
+    # Update Streak (Monthly)
+    await update_monthly_streak(user_id)
+
+    if len(receipts) == 1:
+        message = "Receipt uploaded and processed"
+    else:
+        message = f"{len(receipts)} receipts uploaded and processed"
+    response = upload_response(message, receipts)
+    # Per-stage wall times in ms, a list when the photo held several receipts
+    response["timings"] = timings[0] if timings and len(timings) == 1 else timings
+    return response
+
+
+async def create_upload_job(
+    user_id: str,
+    file_hash: str,
+    filepath: str,
+    manual_date: Optional[str] = None,
+    manual_category: Optional[str] = None,
+    lane: str = "interactive"
+) -> str:
+    """
+    Queues OCR of a saved upload (see job_queue) and returns the job id;
+    progress is read back with get_upload_job. Raises AdmissionQueueFull
+    when JOB_MAX_QUEUED jobs of this lane are already waiting.
+    """
+    if JOB_MAX_QUEUED and await count_queued(lane=lane) >= JOB_MAX_QUEUED:
+        raise AdmissionQueueFull(lane, JOB_QUEUE_RETRY_AFTER_SECONDS)
+    return await enqueue({
+        "user_id": user_id,
+        "image_url": filepath,
+        "content_hash": file_hash,
+        "manual_date": manual_date,
+        "manual_category": manual_category,
+        "lane": lane,
+        "priority": LANES.index(lane)
+    })
+
+
+def discard_upload_file(filepath: str):
+    """
+    Removes the stored image of an upload that was abandoned before any
+    receipt was saved for it.
+    """
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    except OSError as e:
+        logger.error(f"Could not remove abandoned upload {filepath}: {e}")
+
+
+async def discard_upload_job(job: Dict):
+    # on_cancel for the job workers
+    discard_upload_file(job["image_url"])
+
+
+async def cancel_upload_job(job_id: str, user_id: str) -> Optional[Dict]:
+    """
+    Cancels the owner's upload job (see job_queue.request_cancel) and returns
+    its status, or None if there is no such job. The stored image is removed
+    here for jobs that never ran, by the worker for running ones.
+    """
+    try:
+        job_oid = ObjectId(job_id)
+    except Exception:
+        return None
+    job = await request_cancel({"_id": job_oid, "user_id": user_id})
+    if job is None:
+        return None
+    if job["status"] == "cancelled":
+        discard_upload_file(job["image_url"])
+    return await get_upload_job(job_id, user_id)
+
+
+async def _discard_partial_receipts(job_id: str):
+    # A previous attempt may have died after saving some of its receipts
+    db = get_database()
+    receipts = await db.receipts.find({"job_id": job_id}, {"_id": 1}).to_list(length=None)
+    if receipts:
+        receipt_ids = [str(r["_id"]) for r in receipts]
+        await db.expenses.delete_many({"receipt_id": {"$in": receipt_ids}})
+        await db.receipts.delete_many({"job_id": job_id})
+        logger.info(f"Removed {len(receipt_ids)} receipt(s) left by an earlier attempt of job {job_id}")
+
+
+async def handle_upload_job(job: Dict, progress: Callable) -> Dict:
+    """
+    Job handler for queued uploads: OCRs the stored image and saves its receipts.
+    """
+    job_id = str(job["_id"])
+    with open(job["image_url"], "rb") as f:
+        file_bytes = f.read()
+    # Always: a run interrupted by a shutdown is released without counting as an attempt
+    await _discard_partial_receipts(job_id)
+    return await process_upload(
+        job["user_id"], file_bytes, job["content_hash"], job["image_url"],
+        manual_date=job.get("manual_date"), manual_category=job.get("manual_category"),
+        progress=progress, job_id=job_id,
+        # Job workers are few and already bounded; they wait for a slot rather than fail
+        lane=job.get("lane", "interactive"), block=True
+    )
+
+
+async def get_upload_job(job_id: str, user_id: str) -> Optional[Dict]:
+    """
+    The job's status for its owner, or None if there is no such job.
+    """
+    try:
+        job_oid = ObjectId(job_id)
+    except Exception:
+        return None
+    db = get_database()
+    job = await db.ocr_jobs.find_one({"_id": job_oid, "user_id": user_id})
+    if not job:
+        return None
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "cancel_requested": job.get("cancel_requested", False),
+        "created_at": job["created_at"],
+        "updated_at": job.get("updated_at")
+    }
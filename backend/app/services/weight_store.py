@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Directory of pre-fetched doctr weights (see fetch_ocr_weights.py). When set,
+# models are loaded only from here and never downloaded.
+OCR_WEIGHTS_DIR = os.getenv("OCR_WEIGHTS_DIR", "")
+
+MANIFEST_NAME = "manifest.json"
+FETCH_HINT = "run `python fetch_ocr_weights.py --dir {dir}` on a machine with network access"
+
+# path -> (size, mtime) of files whose checksum already matched in this process
+_verified: Dict[str, tuple] = {}
+
+
+class WeightStoreError(RuntimeError):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(weights_dir: str = OCR_WEIGHTS_DIR) -> Dict:
+    """
+    Returns {arch: {"file", "sha256", "url"}} from the store's manifest.json.
+    """
+    path = os.path.join(weights_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise WeightStoreError(f"No weight manifest at {path}; {FETCH_HINT.format(dir=weights_dir)}")
+    try:
+        with open(path) as f:
+            return json.load(f)["weights"]
+    except (ValueError, KeyError) as e:
+        raise WeightStoreError(f"Weight manifest {path} is unreadable: {e}")
+
+
+def _verify_file(arch: str, entry: Dict, weights_dir: str) -> str:
+    path = os.path.join(weights_dir, entry["file"])
+    if not os.path.exists(path):
+        raise WeightStoreError(f"Weights for {arch} are missing ({path}); {FETCH_HINT.format(dir=weights_dir)}")
+
+    stat = os.stat(path)
+    if _verified.get(path) == (stat.st_size, stat.st_mtime):
+        return path
+    actual = file_sha256(path)
+    if actual != entry["sha256"]:
+        raise WeightStoreError(
+            f"Checksum mismatch for {arch} ({path}): expected {entry['sha256']}, got {actual}; "
+            f"the file is corrupt or partial, {FETCH_HINT.format(dir=weights_dir)}"
+        )
+    _verified[path] = (stat.st_size, stat.st_mtime)
+    return path
+
+
+def weight_path(arch: str, weights_dir: str = OCR_WEIGHTS_DIR) -> str:
+    """
+    Local path of the verified weight file for a doctr architecture.
+    Raises WeightStoreError if it is not in the store or fails its checksum.
+    """
+    manifest = load_manifest(weights_dir)
+    if arch not in manifest:
+        raise WeightStoreError(f"No weights for {arch} in {weights_dir}; {FETCH_HINT.format(dir=weights_dir)}")
+    return _verify_file(arch, manifest[arch], weights_dir)
+
+
+def verify_weight_store(archs: Optional[List[str]] = None, weights_dir: str = OCR_WEIGHTS_DIR) -> Dict:
+    """
+    Checks every weight file in the store (or just archs) against its checksum,
+    so a broken store fails at startup instead of on the first upload.
+    """
+    start = time.perf_counter()
+    manifest = load_manifest(weights_dir)
+    for arch in archs or list(manifest):
+        weight_path(arch, weights_dir)
+    seconds = time.perf_counter() - start
+    logger.info(f"Verified {len(archs or manifest)} OCR weight file(s) in {weights_dir} ({seconds:.1f}s)")
+    return {"files": len(archs or manifest), "seconds": round(seconds, 3)}
@@ -0,0 +1,23 @@
+"""
+OCR logging helpers. Kept apart from ocr_service so the API process can log
+without importing torch, doctr and OpenCV.
+"""
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("app.services.ocr_service")
+
+
+def log_to_file(msg):
+    try:
+        with open("D:/ReceiptAnalyzer/backend/ocr_debug.log", "a") as f:
+            f.write(f"{datetime.now()} - {msg}\n")
+    except:
+        pass
+
+
+def log_error(message, error=None):
+    if error:
+        logger.exception(message)
+    else:
+        logger.error(message)
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark for the receipt text analyzers.
+
+Times ReceiptAnalyzer (legacy) against CompiledReceiptAnalyzer on the same
+OCR text and checks that both return identical results for every receipt.
+The text comes from a saved corpus, or is read once from receipt images
+(OCR time is not part of the measurement).
+
+Usage (from the backend directory):
+    python bench_analyzer.py --dir uploads --save-corpus analyzer_corpus.json
+    python bench_analyzer.py --corpus analyzer_corpus.json --repeat 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from bench_ocr_profiles import load_images, percentile
+from app.services.ocr_service import CompiledReceiptAnalyzer, ReceiptAnalyzer, extract_text
+
+
+def corpus_from_images(folder, limit):
+    corpus = {}
+    for name, content in load_images(folder, limit):
+        # extract_text prints every OCR line; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            raw_text = extract_text(content).get("raw_text", "")
+        # raw_text is the analyzer's text blocks joined by newlines
+        corpus[name] = raw_text.split("\n") if raw_text else []
+    return corpus
+
+
+def time_analyzer(analyzer, corpus, repeat):
+    per_receipt = []
+    for text_blocks in corpus.values():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            analyzer.analyze_text(text_blocks)
+        per_receipt.append((time.perf_counter() - start) / repeat)
+    return per_receipt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the receipt text analyzers")
+    parser.add_argument("--corpus", help="JSON file mapping receipt name to its list of text lines")
+    parser.add_argument("--dir", default="uploads", help="Folder with receipt images (when no --corpus)")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--save-corpus", help="Write the OCR text read from --dir to this JSON file")
+    parser.add_argument("--repeat", type=int, default=200, help="Parses per receipt per analyzer")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+    else:
+        print(f"Reading OCR text from {args.dir}...")
+        corpus = corpus_from_images(args.dir, args.limit)
+        if args.save_corpus:
+            with open(args.save_corpus, "w") as f:
+                json.dump(corpus, f, indent=2, ensure_ascii=False)
+    if not corpus:
+        print("Empty corpus")
+        return
+
+    legacy, compiled = ReceiptAnalyzer(), CompiledReceiptAnalyzer()
+    mismatches = [
+        name for name, text_blocks in corpus.items()
+        if repr(legacy.analyze_text(text_blocks)) != repr(compiled.analyze_text(text_blocks))
+    ]
+
+    print(f"Parsing {len(corpus)} receipt(s) x {args.repeat}\n")
+    header = f"{'analyzer':<9} {'avg us':>8} {'p50 us':>8} {'p95 us':>8}"
+    print(header)
+    print("-" * len(header))
+    averages = {}
+    for label, analyzer in (("legacy", legacy), ("compiled", compiled)):
+        per_receipt = time_analyzer(analyzer, corpus, args.repeat)
+        averages[label] = sum(per_receipt) / len(per_receipt)
+        print(
+            f"{label:<9} {1e6 * averages[label]:>8.0f} "
+            f"{1e6 * percentile(per_receipt, 50):>8.0f} {1e6 * percentile(per_receipt, 95):>8.0f}"
+        )
+    print(f"\nSpeedup: {averages['legacy'] / averages['compiled']:.2f}x")
+
+    if mismatches:
+        print(f"\n{len(mismatches)} receipt(s) parsed differently: {', '.join(mismatches)}")
+        sys.exit(1)
+    print("Outputs identical on every receipt")
+
+
+if __name__ == "__main__":
+    main()
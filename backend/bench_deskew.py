@@ -0,0 +1,87 @@
+"""
+Benchmarks the downsampled skew estimator against the full-resolution one.
+
+Both run on the resized image that deskew() sees during preprocessing.
+Reports per-image time and the angle difference, and flags images where the
+difference is above the tolerance or where the two disagree on whether the
+±30° guard applies.
+
+Usage (from the backend directory):
+    python bench_deskew.py --dir uploads --tolerance 0.5
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from app.services.ocr_service import (
+    decode_image, resize_for_ocr, estimate_skew_angle, estimate_skew_angle_full
+)
+
+
+def timed(fn, image, repeat):
+    best, angle = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        angle = fn(image)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, angle
+
+
+def guarded(angle):
+    return angle is not None and abs(angle) <= 30
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark skew estimation")
+    parser.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image (best time is kept)")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed angle difference in degrees")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.dir, "*.jpg")) + glob.glob(os.path.join(args.dir, "*.png")))
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        print(f"No images found in {args.dir}")
+        return
+
+    print(f"{'image':<42} {'full ms':>8} {'fast ms':>8} {'full deg':>9} {'fast deg':>9} {'diff':>6}")
+    total_full = total_fast = 0.0
+    outside = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            image = resize_for_ocr(decode_image(f.read()))
+        full_t, full_angle = timed(estimate_skew_angle_full, image, args.repeat)
+        fast_t, fast_angle = timed(estimate_skew_angle, image, args.repeat)
+        total_full += full_t
+        total_fast += fast_t
+
+        if full_angle is None or fast_angle is None:
+            diff = None
+            ok = full_angle is None and fast_angle is None
+        else:
+            diff = abs(full_angle - fast_angle)
+            ok = guarded(full_angle) == guarded(fast_angle) and (not guarded(full_angle) or diff <= args.tolerance)
+        outside += 0 if ok else 1
+
+        fmt = lambda a: f"{a:>9.2f}" if a is not None else f"{'-':>9}"
+        print(
+            f"{os.path.basename(path):<42} {1000 * full_t:>8.1f} {1000 * fast_t:>8.1f} "
+            f"{fmt(full_angle)} {fmt(fast_angle)} {(f'{diff:.2f}' if diff is not None else '-'):>6}"
+            f"{'' if ok else '  <-- outside tolerance'}"
+        )
+
+    n = len(paths)
+    print(f"\nAverage over {n} image(s): full {1000 * total_full / n:.1f} ms, fast {1000 * total_fast / n:.1f} ms "
+          f"({total_full / max(total_fast, 1e-9):.1f}x). {n - outside}/{n} within ±{args.tolerance}°")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the OCR inference backends (OCR_BACKEND) on a folder of receipts.
+
+Each backend runs in its own process so model load time and peak memory are
+measured in isolation. Reports latency, peak RSS and how often merchant,
+total and date agree with the float32 "torch" backend.
+
+Usage (from the backend directory):
+    python bench_ocr_backends.py --dir uploads --limit 20
+    python bench_ocr_backends.py --profile fast --backends torch,int8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from bench_ocr_profiles import fields_of, load_images, peak_rss_mb, percentile
+
+
+def run_backend(backend, profile, images, queue):
+    from bench_ocr_profiles import run_profile
+    from app.services.ocr_service import OCR_BACKEND, model_load_seconds
+    assert OCR_BACKEND == backend, f"worker loaded OCR_BACKEND={OCR_BACKEND}, expected {backend}"
+
+    outputs, latencies, wall = run_profile(profile, images)
+    peak_mb = peak_rss_mb()
+    queue.put((outputs, latencies, wall, model_load_seconds.get(profile, 0.0), peak_mb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR inference backends")
+    parser.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--profile", default=os.getenv("OCR_PROFILE", "accurate"), help="OCR profile to run")
+    parser.add_argument("--backends", default="torch,int8", help="Comma separated backend names")
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    # Agreement is measured against the float32 backend, so always run it
+    if "torch" not in backends:
+        backends.insert(0, "torch")
+
+    images = load_images(args.dir, args.limit)
+    if not images:
+        print(f"No images found in {args.dir}")
+        return
+    print(f"Benchmarking {len(backends)} backend(s) with profile {args.profile} on {len(images)} image(s) from {args.dir}\n")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in backends:
+        print(f"Running {backend}...")
+        queue = ctx.Queue()
+        # OCR_BACKEND is read when ocr_service is imported, which the spawned
+        # process does while re-importing this script, so it must be in its environment
+        os.environ["OCR_BACKEND"] = backend
+        proc = ctx.Process(target=run_backend, args=(backend, args.profile, images, queue))
+        proc.start()
+        results[backend] = queue.get()
+        proc.join()
+
+    reference = results["torch"][0]
+    header = f"{'backend':<8} {'load s':>7} {'avg ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} {'peak MB':>8} {'merchant':>9} {'total':>7} {'date':>7}"
+    print("\n" + header)
+    print("-" * len(header))
+    for backend in backends:
+        outputs, latencies, wall, load_seconds, peak_mb = results[backend]
+        peak = f"{peak_mb:.0f}" if peak_mb is not None else "n/a"
+        agree = {"merchant": 0, "total": 0, "date": 0}
+        for name, output in outputs.items():
+            ref, got = fields_of(reference[name]), fields_of(output)
+            for field in agree:
+                if ref[field] == got[field]:
+                    agree[field] += 1
+        n = len(outputs)
+        print(
+            f"{backend:<8} {load_seconds:>7.1f} "
+            f"{1000 * sum(latencies) / n:>8.0f} {1000 * percentile(latencies, 50):>8.0f} "
+            f"{1000 * percentile(latencies, 95):>8.0f} {n / wall:>7.2f} {peak:>8} "
+            f"{100 * agree['merchant'] / n:>8.0f}% {100 * agree['total'] / n:>6.0f}% {100 * agree['date'] / n:>6.0f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
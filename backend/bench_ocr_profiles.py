@@ -0,0 +1,135 @@
+"""
+Benchmarks the OCR architecture profiles on a folder of receipts.
+
+Reports latency and throughput for each profile, and how often merchant,
+total and date agree with the "accurate" profile.
+
+Usage (from the backend directory):
+    python bench_ocr_profiles.py --dir uploads --limit 20
+    python bench_ocr_profiles.py --profiles accurate,fast
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+try:
+    import psutil  # optional; provides the peak memory on Windows
+except ImportError:
+    psutil = None
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from app.services.ocr_service import OCR_PROFILES, extract_text, get_model, model_load_seconds
+
+
+def load_images(folder, limit):
+    paths = sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.png")))
+    if limit:
+        paths = paths[:limit]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process; None when it cannot be measured
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # peak_wset is the peak working set on Windows
+        return getattr(info, "peak_wset", info.rss) / 1e6
+    return None
+
+
+def fields_of(result):
+    date = result.get("date_extracted")
+    return {
+        "merchant": (result.get("merchant_name") or "").strip().upper(),
+        "total": result.get("total_amount"),
+        "date": date.date() if date else None,
+    }
+
+
+def run_profile(profile, images):
+    get_model(profile)
+    outputs = {}
+    latencies = []
+    start = time.perf_counter()
+    for name, content in images:
+        t0 = time.perf_counter()
+        # extract_text prints every OCR line; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs[name] = extract_text(content, profile)
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - start
+    return outputs, latencies, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR architecture profiles")
+    parser.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    parser.add_argument("--profiles", default=",".join(OCR_PROFILES), help="Comma separated profile names")
+    args = parser.parse_args()
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    # Agreement is measured against the accurate profile, so always run it
+    if "accurate" not in profiles:
+        profiles.insert(0, "accurate")
+
+    images = load_images(args.dir, args.limit)
+    if not images:
+        print(f"No images found in {args.dir}")
+        return
+    print(f"Benchmarking {len(profiles)} profile(s) on {len(images)} image(s) from {args.dir}\n")
+
+    results = {}
+    for profile in profiles:
+        det_arch, reco_arch = OCR_PROFILES[profile]
+        print(f"Running {profile} ({det_arch} + {reco_arch})...")
+        results[profile] = run_profile(profile, images)
+
+    reference = results["accurate"][0]
+    header = f"{'profile':<10} {'load s':>7} {'avg ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} {'merchant':>9} {'total':>7} {'date':>7}"
+    print("\n" + header)
+    print("-" * len(header))
+    for profile in profiles:
+        outputs, latencies, wall = results[profile]
+        agree = {"merchant": 0, "total": 0, "date": 0}
+        for name, output in outputs.items():
+            ref, got = fields_of(reference[name]), fields_of(output)
+            for field in agree:
+                if ref[field] == got[field]:
+                    agree[field] += 1
+        n = len(outputs)
+        print(
+            f"{profile:<10} {model_load_seconds.get(profile, 0.0):>7.1f} "
+            f"{1000 * sum(latencies) / n:>8.0f} {1000 * percentile(latencies, 50):>8.0f} "
+            f"{1000 * percentile(latencies, 95):>8.0f} {n / wall:>7.2f} "
+            f"{100 * agree['merchant'] / n:>8.0f}% {100 * agree['total'] / n:>6.0f}% {100 * agree['date'] / n:>6.0f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Sweeps OCR worker / thread-per-worker combinations and reports throughput,
+to pick OCR_WORKERS and OCR_THREADS_PER_WORKER for this host.
+
+Every combination gets a fresh process pool configured like the API's, is
+warmed up, then OCRs the whole image set (repeated --rounds times) with all
+workers busy.
+
+Usage (from the backend directory):
+    python bench_ocr_threads.py --dir uploads --limit 8
+    python bench_ocr_threads.py --workers 1,2,4 --threads 1,2,4,8 --affinity
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from bench_ocr_profiles import load_images, percentile
+from app.services.ocr_executor import _init_worker, _ocr_task, _warm_up_task
+
+
+def parse_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def run_combo(workers, threads, affinity, images, rounds):
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(ctx.Value("i", 0), threads, affinity),
+    ) as pool:
+        # Start and warm every worker before timing
+        for future in [pool.submit(_warm_up_task) for _ in range(workers)]:
+            future.result()
+
+        jobs = [content for _ in range(rounds) for _, content in images]
+        submitted = {}
+        start = time.perf_counter()
+        for content in jobs:
+            submitted[pool.submit(_ocr_task, content)] = time.perf_counter()
+        latencies = []
+        for future, t0 in submitted.items():
+            future.result()
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start
+    return len(jobs) / wall, latencies
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Sweep OCR worker and thread counts")
+    parser.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    parser.add_argument("--limit", type=int, default=8, help="Only use the first N images")
+    parser.add_argument("--rounds", type=int, default=1, help="Times to OCR the image set per combination")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated worker counts")
+    parser.add_argument("--threads", default="1,2,4", help="Comma separated threads per worker")
+    parser.add_argument("--affinity", action="store_true", help="Pin workers to their own cores")
+    parser.add_argument("--oversubscribe", action="store_true", help="Also run combinations using more threads than cores")
+    args = parser.parse_args()
+
+    images = load_images(args.dir, args.limit)
+    if not images:
+        print(f"No images found in {args.dir}")
+        return
+
+    combos = [
+        (w, t) for w in parse_list(args.workers) for t in parse_list(args.threads)
+        if args.oversubscribe or w * t <= cpus
+    ]
+    print(f"Sweeping {len(combos)} combination(s) on {len(images)} image(s) x {args.rounds} round(s), {cpus} CPU(s)\n")
+
+    header = f"{'workers':>7} {'threads':>7} {'img/s':>7} {'p50 ms':>8} {'p95 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    best = None
+    for workers, threads in combos:
+        throughput, latencies = run_combo(workers, threads, args.affinity, images, args.rounds)
+        print(
+            f"{workers:>7} {threads:>7} {throughput:>7.2f} "
+            f"{1000 * percentile(latencies, 50):>8.0f} {1000 * percentile(latencies, 95):>8.0f}"
+        )
+        if best is None or throughput > best[2]:
+            best = (workers, threads, throughput)
+
+    if best:
+        print(f"\nBest: OCR_WORKERS={best[0]} OCR_THREADS_PER_WORKER={best[1]} ({best[2]:.2f} img/s)")
+
+
+if __name__ == "__main__":
+    main()
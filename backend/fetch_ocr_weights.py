@@ -0,0 +1,99 @@
+"""
+Populates the offline OCR weight store used when OCR_WEIGHTS_DIR is set.
+
+Downloads the doctr weights for every architecture in the selected profiles,
+checks each file against the hash in its doctr URL and records its sha256 in
+manifest.json. Copy the resulting directory to hosts without network access.
+
+Usage (from the backend directory):
+    python fetch_ocr_weights.py --dir ocr_weights
+    python fetch_ocr_weights.py --dir ocr_weights --profiles accurate,fast
+    python fetch_ocr_weights.py --dir ocr_weights --source-dir ~/.cache/doctr/models
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import urllib.request
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from doctr.models import detection, recognition
+
+from app.services.ocr_service import OCR_PROFILES
+from app.services.weight_store import MANIFEST_NAME, OCR_WEIGHTS_DIR, file_sha256
+
+
+def weight_url(arch):
+    for package in (detection, recognition):
+        if arch in package.__dict__:
+            builder = package.__dict__[arch]
+            return sys.modules[builder.__module__].default_cfgs[arch]["url"]
+    raise ValueError(f"Unknown doctr architecture '{arch}'")
+
+
+def file_name(url):
+    # e.g. https://doctr-static.mindee.com/models?id=v0.7.0/db_resnet50-79bd7d70.pt&src=0
+    return url.split("/")[-1].split("&")[0]
+
+
+def fetch(arch, weights_dir, source_dir=None):
+    url = weight_url(arch)
+    name = file_name(url)
+    # doctr file names end with the first characters of their sha256
+    expected_prefix = name.rsplit("-", 1)[-1].split(".")[0]
+    target = os.path.join(weights_dir, name)
+    tmp_path = f"{target}.tmp"
+
+    if source_dir:
+        shutil.copyfile(os.path.join(os.path.expanduser(source_dir), name), tmp_path)
+    else:
+        request = urllib.request.Request(url, headers={"User-Agent": "Receipt-Analyzer"})
+        with urllib.request.urlopen(request) as response, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(response, f)
+
+    sha256 = file_sha256(tmp_path)
+    if not sha256.startswith(expected_prefix):
+        os.remove(tmp_path)
+        raise ValueError(f"{name}: sha256 {sha256} does not match the expected prefix {expected_prefix}")
+    os.replace(tmp_path, target)
+    return {"file": name, "sha256": sha256, "url": url}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch doctr weights into the offline weight store")
+    parser.add_argument("--dir", default=OCR_WEIGHTS_DIR or "ocr_weights", help="Weight store directory")
+    parser.add_argument("--profiles", default=",".join(OCR_PROFILES), help="Comma separated profile names")
+    parser.add_argument("--source-dir", help="Copy files from this directory instead of downloading")
+    args = parser.parse_args()
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    archs = sorted({arch for profile in profiles for arch in OCR_PROFILES[profile]})
+
+    os.makedirs(args.dir, exist_ok=True)
+    manifest_path = os.path.join(args.dir, MANIFEST_NAME)
+    manifest = {"weights": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    failed = []
+    for arch in archs:
+        try:
+            manifest["weights"][arch] = fetch(arch, args.dir, args.source_dir)
+            print(f"{arch}: {manifest['weights'][arch]['file']} ok")
+        except Exception as e:
+            failed.append(arch)
+            print(f"{arch}: FAILED ({e})")
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"\nWrote {manifest_path} ({len(manifest['weights'])} architecture(s))")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Golden-corpus regression and throughput harness for the OCR pipeline.
+
+Runs extract_text over a folder of receipts and compares merchant, total,
+date and items with stored expected outputs, alongside p50/p95 latency and
+memory per pipeline stage. Runs are saved as JSON so two of them (e.g. before
+and after a preprocessing or model change) can be diffed.
+
+Usage (from the backend directory):
+    # Write expected outputs from the current pipeline, then correct them by hand
+    python ocr_golden.py record --dir uploads --expected golden/expected.json
+
+    # Score the pipeline against them and save the run
+    python ocr_golden.py run --dir uploads --expected golden/expected.json --out golden/runs/base.json
+
+    # Compare two saved runs
+    python ocr_golden.py diff golden/runs/base.json golden/runs/new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import psutil  # optional; provides the current RSS on Windows
+except ImportError:
+    psutil = None
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from bench_ocr_profiles import load_images, peak_rss_mb, percentile
+import app.services.ocr_service as ocr_service
+
+FIELDS = ("merchant", "total", "date", "items")
+
+
+def rss_mb():
+    # Current resident set size; None when it cannot be measured (reported as "-")
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1e6
+    return peak_rss_mb()
+
+
+def _rounded(value):
+    return round(value, 1) if value is not None else None
+
+
+def _mb(value):
+    return f"{value:.0f} MB" if value is not None else "n/a"
+
+
+def _growth(before, after):
+    return round(after - before, 1) if before is not None and after is not None else None
+
+
+class StageMemory:
+    """
+    Wraps the pipeline stages to record, per image, the RSS at the end of each
+    stage and how much each stage raised the process peak RSS.
+    """
+    def __init__(self):
+        self.rss = {}
+        self.peak_growth = {}
+
+    def reset(self):
+        self.rss, self.peak_growth = {}, {}
+
+    def wrap(self, name, fn):
+        def wrapped(*args, **kwargs):
+            peak_before = peak_rss_mb()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.rss[name] = _rounded(rss_mb())
+                growth = _growth(peak_before, peak_rss_mb())
+                if growth is not None:
+                    self.peak_growth[name] = round(self.peak_growth.get(name, 0.0) + growth, 1)
+        return wrapped
+
+    def install(self):
+        for name, fn in list(ocr_service.PREPROCESS_STAGES.items()):
+            ocr_service.PREPROCESS_STAGES[name] = self.wrap(name, fn)
+        ocr_service.decode_image = self.wrap("decode", ocr_service.decode_image)
+        ocr_service._read_text_blocks = self.wrap("ocr", ocr_service._read_text_blocks)
+        ocr_service.analyzer.analyze_text = self.wrap("analyze", ocr_service.analyzer.analyze_text)
+
+
+def fields_of(result):
+    date = result.get("date_extracted")
+    return {
+        "merchant": result.get("merchant_name"),
+        "total": result.get("total_amount"),
+        "date": date.date().isoformat() if date else None,
+        "items": [{"item_name": i["item_name"], "price": i["price"]} for i in result.get("items", [])],
+    }
+
+
+def normalize_name(value):
+    return " ".join((value or "").upper().split())
+
+
+def item_key(item):
+    return (normalize_name(item["item_name"]), round(float(item["price"]), 2))
+
+
+def compare(expected, got):
+    """
+    Field-level correctness of one receipt, plus item counts for precision/recall.
+    """
+    exp_total, got_total = expected.get("total"), got.get("total")
+    expected_items = [item_key(i) for i in expected.get("items", [])]
+    got_items = [item_key(i) for i in got.get("items", [])]
+    remaining = list(expected_items)
+    matched = 0
+    for key in got_items:
+        if key in remaining:
+            remaining.remove(key)
+            matched += 1
+    return {
+        "merchant": normalize_name(expected.get("merchant")) == normalize_name(got.get("merchant")),
+        "total": (exp_total is None and got_total is None) or (
+            exp_total is not None and got_total is not None and abs(exp_total - got_total) <= 0.01
+        ),
+        "date": expected.get("date") == got.get("date"),
+        "items": matched == len(expected_items) == len(got_items),
+        "items_matched": matched,
+        "items_expected": len(expected_items),
+        "items_found": len(got_items),
+    }
+
+
+def run_pipeline(images, memory=None):
+    results = {}
+    for name, content in images:
+        if memory:
+            memory.reset()
+        peak_before = peak_rss_mb()
+        start = time.perf_counter()
+        # extract_text prints every OCR line; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = ocr_service.extract_text(content)
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        timings = dict(result.get("timings") or {})
+        timings["total"] = total_ms
+
+        rss, growth = {}, {}
+        if memory:
+            rss, growth = dict(memory.rss), dict(memory.peak_growth)
+            # Model passes are timed per profile (ocr_fast, ocr_accurate)
+            ocr_rss, ocr_growth = rss.pop("ocr", None), growth.pop("ocr", None)
+            for stage in timings:
+                if stage.startswith("ocr_") and ocr_rss is not None:
+                    rss[stage], growth[stage] = ocr_rss, ocr_growth
+            rss["total"] = _rounded(rss_mb())
+            growth["total"] = _growth(peak_before, peak_rss_mb())
+        results[name] = {
+            "output": fields_of(result),
+            "timings": timings,
+            "rss_mb": rss,
+            "peak_growth_mb": growth,
+        }
+    return results
+
+
+def summarize(results, expected):
+    summary = {"images": len(results), "accuracy": {}, "items": {}, "stages": {}}
+
+    scored = [compare(expected[name], r["output"]) for name, r in results.items() if name in expected]
+    summary["scored"] = len(scored)
+    if scored:
+        for field in FIELDS:
+            summary["accuracy"][field] = round(sum(s[field] for s in scored) / len(scored), 4)
+        matched = sum(s["items_matched"] for s in scored)
+        found = sum(s["items_found"] for s in scored)
+        wanted = sum(s["items_expected"] for s in scored)
+        summary["items"] = {
+            "precision": round(matched / found, 4) if found else None,
+            "recall": round(matched / wanted, 4) if wanted else None,
+        }
+
+    stages = []
+    for r in results.values():
+        for stage in r["timings"]:
+            if stage not in stages:
+                stages.append(stage)
+    for stage in stages:
+        times = [r["timings"][stage] for r in results.values() if stage in r["timings"]]
+        rss = [r["rss_mb"][stage] for r in results.values() if r["rss_mb"].get(stage) is not None]
+        growth = [r["peak_growth_mb"][stage] for r in results.values() if r["peak_growth_mb"].get(stage) is not None]
+        summary["stages"][stage] = {
+            "p50_ms": percentile(times, 50),
+            "p95_ms": percentile(times, 95),
+            "rss_mb": max(rss) if rss else None,
+            "peak_growth_mb": round(sum(growth), 1) if growth else None,
+        }
+    summary["peak_rss_mb"] = _rounded(peak_rss_mb())
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{summary['images']} image(s), {summary['scored']} with expected output")
+    if summary["accuracy"]:
+        print("Accuracy: " + "  ".join(f"{f} {100 * summary['accuracy'][f]:.1f}%" for f in FIELDS))
+        items = summary["items"]
+        fmt = lambda v: f"{100 * v:.1f}%" if v is not None else "n/a"
+        print(f"Items:    precision {fmt(items['precision'])}  recall {fmt(items['recall'])}")
+
+    header = f"\n{'stage':<10} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8} {'peak +MB':>9}"
+    print(header)
+    print("-" * (len(header) - 1))
+    for stage, s in summary["stages"].items():
+        rss = f"{s['rss_mb']:.0f}" if s["rss_mb"] is not None else "-"
+        growth = f"{s['peak_growth_mb']:.0f}" if s["peak_growth_mb"] is not None else "-"
+        print(f"{stage:<10} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {rss:>8} {growth:>9}")
+    print(f"\nPeak RSS: {_mb(summary['peak_rss_mb'])}")
+
+
+def cmd_record(args):
+    images = load_images(args.dir, args.limit)
+    results = run_pipeline(images)
+    expected = {}
+    if os.path.exists(args.expected):
+        with open(args.expected) as f:
+            expected = json.load(f)
+    added = 0
+    for name, r in results.items():
+        # Never overwrite hand-corrected entries unless asked to
+        if name not in expected or args.overwrite:
+            expected[name] = r["output"]
+            added += 1
+    os.makedirs(os.path.dirname(args.expected) or ".", exist_ok=True)
+    with open(args.expected, "w") as f:
+        json.dump(expected, f, indent=2, ensure_ascii=False)
+    print(f"Recorded {added} expected output(s) in {args.expected}; review and correct them by hand")
+
+
+def cmd_run(args):
+    with open(args.expected) as f:
+        expected = json.load(f)
+    images = [(name, content) for name, content in load_images(args.dir, args.limit)]
+    print(f"Running the OCR pipeline on {len(images)} image(s) from {args.dir}")
+
+    memory = StageMemory()
+    memory.install()
+    if args.warmup:
+        # Keep one-off model loading out of the per-stage numbers
+        ocr_service.warm_up()
+    results = run_pipeline(images, memory)
+    summary = summarize(results, expected)
+    print_summary(summary)
+
+    if args.out:
+        run = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "dir": args.dir,
+                "profile": ocr_service.OCR_PROFILE,
+                "cascade": ocr_service.OCR_CASCADE,
+                "backend": ocr_service.OCR_BACKEND,
+                "analyzer": ocr_service.OCR_ANALYZER,
+                "pipeline": ocr_service.preprocess_pipeline,
+            },
+            "summary": summary,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(run, f, indent=2, ensure_ascii=False)
+        print(f"Saved run to {args.out}")
+
+
+def cmd_diff(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    b, n = base["summary"], new["summary"]
+
+    print(f"base: {args.base} ({base['meta']['created_at']})")
+    print(f"new:  {args.new} ({new['meta']['created_at']})")
+    for key in ("profile", "cascade", "backend", "analyzer", "pipeline"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"  {key}: {base['meta'].get(key)} -> {new['meta'].get(key)}")
+
+    if b["accuracy"] and n["accuracy"]:
+        print(f"\n{'field':<10} {'base':>7} {'new':>7} {'delta':>7}")
+        for field in FIELDS:
+            before, after = 100 * b["accuracy"][field], 100 * n["accuracy"][field]
+            print(f"{field:<10} {before:>6.1f}% {after:>6.1f}% {after - before:>+6.1f}")
+
+    print(f"\n{'stage':<10} {'base p50':>9} {'new p50':>9} {'base p95':>9} {'new p95':>9} {'base MB':>8} {'new MB':>8}")
+    for stage in list(dict.fromkeys(list(b["stages"]) + list(n["stages"]))):
+        bs, ns = b["stages"].get(stage), n["stages"].get(stage)
+        cell = lambda s, k, w: f"{s[k]:>{w}.1f}" if s and s.get(k) is not None else f"{'-':>{w}}"
+        print(
+            f"{stage:<10} {cell(bs, 'p50_ms', 9)} {cell(ns, 'p50_ms', 9)} "
+            f"{cell(bs, 'p95_ms', 9)} {cell(ns, 'p95_ms', 9)} {cell(bs, 'rss_mb', 8)} {cell(ns, 'rss_mb', 8)}"
+        )
+    print(f"\nPeak RSS: {_mb(b['peak_rss_mb'])} -> {_mb(n['peak_rss_mb'])}")
+
+    changed = []
+    for name in base["results"]:
+        if name not in new["results"]:
+            continue
+        before, after = base["results"][name]["output"], new["results"][name]["output"]
+        fields = [field for field in FIELDS if before.get(field) != after.get(field)]
+        if fields:
+            changed.append((name, fields, before, after))
+    print(f"\n{len(changed)} receipt(s) with changed output")
+    for name, fields, before, after in changed[:args.show]:
+        print(f"  {name}")
+        for field in fields:
+            if field == "items":
+                print(f"    items: {len(before['items'])} -> {len(after['items'])}")
+            else:
+                print(f"    {field}: {before.get(field)!r} -> {after.get(field)!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR golden-corpus regression harness")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="Write expected outputs from the current pipeline")
+    record.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    record.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    record.add_argument("--expected", default="golden/expected.json", help="Expected outputs JSON")
+    record.add_argument("--overwrite", action="store_true", help="Replace existing entries too")
+    record.set_defaults(func=cmd_record)
+
+    run = sub.add_parser("run", help="Score the pipeline against the expected outputs")
+    run.add_argument("--dir", default="uploads", help="Folder with receipt images")
+    run.add_argument("--limit", type=int, default=0, help="Only use the first N images")
+    run.add_argument("--expected", default="golden/expected.json", help="Expected outputs JSON")
+    run.add_argument("--out", help="Save the run to this JSON file")
+    run.add_argument("--no-warmup", dest="warmup", action="store_false", help="Include model loading in the first image")
+    run.set_defaults(func=cmd_run)
+
+    diff = sub.add_parser("diff", help="Compare two saved runs")
+    diff.add_argument("base", help="Baseline run JSON")
+    diff.add_argument("new", help="New run JSON")
+    diff.add_argument("--show", type=int, default=20, help="Receipts with changed output to list")
+    diff.set_defaults(func=cmd_diff)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
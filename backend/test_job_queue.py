@@ -0,0 +1,87 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from app.services import job_queue
+
+
+class FakeJobs:
+    """
+    The parts of the ocr_jobs collection the lease watcher touches. The
+    first failures writes raise; with stolen_by set, another worker claims
+    the job just before the first heartbeat lands.
+    """
+    def __init__(self, failures=0, stolen_by=None):
+        self.doc = {"_id": 1, "worker_id": "me", "status": "processing", "stage": "started"}
+        self.failures = failures
+        self.stolen_by = stolen_by
+
+    async def update_one(self, query, update):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo unavailable")
+        if self.stolen_by:
+            self.doc["worker_id"] = self.stolen_by
+        if self.doc["worker_id"] != query["worker_id"]:
+            return SimpleNamespace(matched_count=0)
+        self.doc.update(update["$set"])
+        return SimpleNamespace(matched_count=1)
+
+    async def count_documents(self, query):
+        return 0
+
+
+def run_job(jobs, lease_seconds, handler_seconds):
+    """
+    Runs a job whose handler takes handler_seconds with a fast heartbeat.
+    Returns whether the handler got to finish.
+    """
+    job = {"_id": 1, "attempts": 1, "max_attempts": 3}
+    finished = []
+
+    async def handler(job, progress):
+        await asyncio.sleep(handler_seconds)
+        finished.append(True)
+        return {}
+
+    saved = {name: getattr(job_queue, name) for name in
+             ("_collection", "JOB_HEARTBEAT_SECONDS", "JOB_CANCEL_POLL_SECONDS", "JOB_LEASE_SECONDS")}
+    job_queue._collection = lambda: jobs
+    job_queue.JOB_HEARTBEAT_SECONDS = job_queue.JOB_CANCEL_POLL_SECONDS = 0.01
+    job_queue.JOB_LEASE_SECONDS = lease_seconds
+    try:
+        asyncio.run(job_queue.run_job(job, "me", handler))
+    finally:
+        for name, value in saved.items():
+            setattr(job_queue, name, value)
+    return bool(finished)
+
+
+def test_lost_lease_stops_the_handler():
+    # The new owner has the job now: stop, and leave its record alone
+    jobs = FakeJobs(stolen_by="other")
+    assert not run_job(jobs, lease_seconds=1, handler_seconds=1)
+    assert jobs.doc["worker_id"] == "other"
+    assert jobs.doc["status"] == "processing"
+
+
+def test_heartbeat_retries_after_errors():
+    jobs = FakeJobs(failures=3)
+    assert run_job(jobs, lease_seconds=1, handler_seconds=0.1)
+    assert jobs.doc["status"] == "done"
+
+
+def test_unrenewable_lease_stops_the_handler():
+    jobs = FakeJobs(failures=10 ** 6)
+    assert not run_job(jobs, lease_seconds=0.05, handler_seconds=1)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sys
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from app.services.ocr_admission import AdmissionController, AdmissionQueueFull
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_interactive_lane_goes_first():
+    async def scenario():
+        controller = AdmissionController(1, {"interactive": 4, "bulk": 4})
+        order = []
+
+        async def upload(name, lane):
+            async with controller.slot(lane):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        first = asyncio.create_task(upload("bulk-1", "bulk"))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(upload("bulk-2", "bulk")), asyncio.create_task(upload("interactive", "interactive"))]
+        await asyncio.gather(first, *rest)
+        assert order == ["bulk-1", "interactive", "bulk-2"]
+        assert controller.in_flight == 0
+    run(scenario())
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        controller = AdmissionController(1, {"interactive": 1, "bulk": 0})
+        hold = asyncio.Event()
+
+        async def upload(lane):
+            async with controller.slot(lane):
+                await hold.wait()
+
+        holder = asyncio.create_task(upload("interactive"))
+        waiter = asyncio.create_task(upload("interactive"))
+        await asyncio.sleep(0)
+        for lane in ("interactive", "bulk"):
+            try:
+                async with controller.slot(lane):
+                    pass
+                assert False, "expected AdmissionQueueFull"
+            except AdmissionQueueFull as e:
+                assert e.retry_after >= 1
+        hold.set()
+        await asyncio.gather(holder, waiter)
+        assert controller.stats()["lanes"]["interactive"]["rejected"] == 1
+    run(scenario())
+
+
+def test_cancelled_waiter_released_in_same_tick():
+    # The holder releases after the waiter was cancelled but before it resumed:
+    # the waiter must still end with CancelledError and the slot must be free
+    async def scenario():
+        controller = AdmissionController(1, {"interactive": 2, "bulk": 2})
+        hold = asyncio.Event()
+
+        async def upload():
+            async with controller.slot("interactive"):
+                await hold.wait()
+
+        holder = asyncio.create_task(upload())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(upload())
+        await asyncio.sleep(0)
+        hold.set()
+        waiter.cancel()
+        results = await asyncio.gather(holder, waiter, return_exceptions=True)
+        assert results[0] is None
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert controller.in_flight == 0
+        assert not any(controller.stats()["lanes"][lane]["queued"] for lane in ("interactive", "bulk"))
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        controller = AdmissionController(1, {"interactive": 2, "bulk": 2})
+        hold = asyncio.Event()
+
+        async def upload():
+            async with controller.slot("interactive"):
+                await hold.wait()
+
+        holder = asyncio.create_task(upload())
+        waiter = asyncio.create_task(upload())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["lanes"]["interactive"]["queued"] == 0
+        hold.set()
+        await holder
+        assert controller.in_flight == 0
+    run(scenario())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
@@ -0,0 +1,54 @@
+import os
+import sys
+from types import SimpleNamespace
+
+# Add the current directory to sys.path so 'app' can be found
+sys.path.append(os.getcwd())
+
+from app.services.ocr_service import OCR_TILE_HEIGHT, OCR_TILE_OVERLAP, _stitch_tiles
+
+LINE_HEIGHT = 30
+Y0 = OCR_TILE_HEIGHT - OCR_TILE_OVERLAP   # offset of the second strip
+BOUNDARY = Y0 + OCR_TILE_OVERLAP / 2      # where the strips' own bands meet
+
+
+def strip(y0, lines):
+    """
+    A stub Doctr page for the strip starting at y0; lines are (text, absolute y centre).
+    """
+    def line(text, y):
+        top, bottom = (y - y0 - LINE_HEIGHT / 2) / OCR_TILE_HEIGHT, (y - y0 + LINE_HEIGHT / 2) / OCR_TILE_HEIGHT
+        return SimpleNamespace(words=[SimpleNamespace(value=text)], geometry=((0.1, top), (0.9, bottom)))
+    return SimpleNamespace(dimensions=(OCR_TILE_HEIGHT, 1000), blocks=[SimpleNamespace(lines=[line(t, y) for t, y in lines])])
+
+
+def stitch(first, second):
+    return _stitch_tiles([
+        (strip(0, first), (0, 0, BOUNDARY)),
+        (strip(Y0, second), (Y0, BOUNDARY, Y0 + OCR_TILE_HEIGHT)),
+    ])
+
+
+def test_line_read_on_both_sides_of_boundary_is_kept_once():
+    # Each strip puts the same printed line just on its own side of the boundary
+    lines = stitch(
+        [("BREAD", BOUNDARY - 60), ("MILK 1L 120.00", BOUNDARY - 3)],
+        [("MILK 1L 120.00", BOUNDARY + 3), ("TOTAL 240.00", BOUNDARY + 60)],
+    )
+    assert lines == ["BREAD", "MILK 1L 120.00", "TOTAL 240.00"]
+
+
+def test_repeated_rows_across_boundary_are_kept():
+    # Two real rows either side of the boundary, both inside the overlap
+    lines = stitch(
+        [("MILK 1L 120.00", BOUNDARY - 30)],
+        [("MILK 1L 120.00", BOUNDARY + 25), ("TOTAL 240.00", BOUNDARY + 60)],
+    )
+    assert lines == ["MILK 1L 120.00", "MILK 1L 120.00", "TOTAL 240.00"]
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
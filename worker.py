@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+# Get the absolute path to the backend directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.join(current_dir, "backend")
+
+
+async def run():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from app.database import check_db_connection
+    from app.services.job_queue import JOB_WORKER_CONCURRENCY, ensure_job_indexes, start_workers, stop_workers
+    from app.services.ocr_executor import OCR_WARMUP, get_executor, shutdown_executor, warm_up_workers
+    from app.services.receipt_service import discard_upload_job, ensure_receipt_indexes, handle_upload_job
+
+    from app.services.ocr_profiles import active_archs
+    from app.services.weight_store import OCR_WEIGHTS_DIR, verify_weight_store
+
+    await check_db_connection()
+    if OCR_WEIGHTS_DIR:
+        # Refuse to start with a store that lacks the configured profiles' weights
+        verify_weight_store(active_archs())
+    await ensure_job_indexes()
+    await ensure_receipt_indexes()
+    get_executor()
+    if OCR_WARMUP:
+        await warm_up_workers()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C still raises KeyboardInterrupt
+            pass
+
+    start_workers(handle_upload_job, JOB_WORKER_CONCURRENCY, on_cancel=discard_upload_job)
+    try:
+        await stop.wait()
+    finally:
+        # Jobs still running go back to the queue for another worker
+        await stop_workers()
+        shutdown_executor()
+
+
+def main():
+    print(f"Starting Receipt Analyzer OCR worker...")
+    print(f"Setting working directory to: {backend_dir}")
+
+    # Change working directory to backend so that .env, uploads/ and app module are found
+    if os.path.exists(backend_dir):
+        os.chdir(backend_dir)
+        sys.path.insert(0, backend_dir)
+    else:
+        print(f"Error: Could not find 'backend' directory at {backend_dir}")
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()